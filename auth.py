@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, session, redirect, render_template, url_for
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db, User
-from flask_mail import Message
+from mailer import mail_queue
+from passwords import HashingBusy, password_hasher
+from throttle import login_throttle
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import os
 
@@ -18,6 +20,9 @@ def register():
     password = data.get('password', '')
     if not full_name or not email or not password:
         return jsonify({'status': 'error', 'message': 'Full name, email, and password required'}), 400
+    throttled = login_throttle.hit()
+    if throttled:
+        return throttled
     if User.query.filter_by(email=email).first():
         return jsonify({'status': 'error', 'message': 'Email already registered'}), 400
     user = User()
@@ -36,13 +41,29 @@ def login():
         return jsonify({'status': 'error', 'message': 'No data provided'}), 400
     email = data.get('email', '').strip().lower()
     password = data.get('password', '')
+    # Rejected before the password hash is computed
+    throttled = login_throttle.hit(email)
+    if throttled:
+        return throttled
     user = User.query.filter_by(email=email).first()
     if user and user.check_password(password):
+        if user.password_needs_rehash():
+            # Hash parameters changed since this password was set; upgrade it while we have the plaintext
+            user.set_password(password)
+            db.session.commit()
+            password_hasher.record_rehash()
         login_user(user)
         session.permanent = True
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error', 'message': 'Invalid email or password'}), 401
 
+@auth_bp.app_errorhandler(HashingBusy)
+def hashing_busy(error):
+    response = jsonify({'status': 'error', 'message': 'Server busy, please try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @auth_bp.route('/logout', methods=['POST'])
 @login_required
 def logout():
@@ -51,7 +72,6 @@ def logout():
 
 @auth_bp.route('/forgot', methods=['POST'])
 def forgot_password():
-    from main import mail
     data = request.json if request.is_json else None
     if not data:
         return jsonify({'status': 'error', 'message': 'No data provided'}), 400
@@ -61,9 +81,9 @@ def forgot_password():
         return jsonify({'status': 'error', 'message': 'No account with that email'}), 404
     token = serializer.dumps(email, salt='password-reset-salt')
     reset_url = url_for('auth.reset_password_token', token=token, _external=True)
-    msg = Message('Password Reset Request', recipients=[email])
-    msg.body = f'Click the link to reset your password: {reset_url}\nIf you did not request this, please ignore this email.'
-    mail.send(msg)
+    body = f'Click the link to reset your password: {reset_url}\nIf you did not request this, please ignore this email.'
+    # Delivered by the background mail queue; the request does not wait for SMTP
+    mail_queue.enqueue('Password Reset Request', [email], body)
     return jsonify({'status': 'success', 'message': 'Password reset instructions sent to your email.'})
 
 @auth_bp.route('/reset_password/<token>', methods=['GET', 'POST'])
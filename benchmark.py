@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the task, budget, search, export and chatbot endpoints.
+
+Seed a local database, drive the endpoints in-process (Flask test client)
+or over real HTTP with concurrent workers, and compare against a baseline:
+
+    python benchmark.py seed --db bench.db --users 10 --tasks 100000
+    python benchmark.py run --db bench.db --requests 200 --concurrency 4 --output results.json
+    python benchmark.py run --url http://localhost:5000 --concurrency 16 --output results.json
+    python benchmark.py compare results.json --baseline baseline.json --threshold 10
+
+Queries per request come from the app's /metrics endpoint (pass
+--metrics-token if METRICS_TOKEN is set). In HTTP mode the server must be running against a seeded database, and
+LOGIN_RATE_PER_IP must allow one login per worker.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'benchmark'
+TASK_TYPES = ('Decommission', 'Decommission and Retrieval', 'Infra Works', 'Relocation')
+STATUSES = ('Active', 'On hold', 'Closed')
+OWNERS = ('alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi')
+SEARCH_TERMS = ('alice', 'Site 1', 'Relocation', 'grace', 'Infra')
+
+# name -> (method, path, metrics endpoint label)
+SCENARIOS = {
+    'dashboard': ('GET', '/dashboard', 'tasks.dashboard'),
+    'search': ('GET', '/search?q={term}&type=all', 'tasks.search_tasks'),
+    'budget': ('GET', '/budget', 'budget_dashboard'),
+    'progress_csv': ('GET', '/progress.csv', 'tasks.download_progress_csv'),
+    'add': ('POST', '/add', 'tasks.add_task'),
+    'chatbot': ('POST', '/chatbot', 'chatbot.chatbot'),
+}
+
+
+def user_email(i):
+    return f'bench{i}@example.com'
+
+
+def load_app(db_path):
+    """Import the app against ``db_path``; environment must be set before main is imported."""
+    os.environ['SUPABASE_DATABASE_URL'] = 'sqlite:///' + os.path.abspath(db_path)
+    os.environ.setdefault('MAIL_QUEUE_WORKERS', '0')
+    # Every worker logs in from the same address
+    os.environ.setdefault('LOGIN_RATE_PER_IP', '100000')
+    import main
+    return main.app
+
+
+def seed(args):
+    app = load_app(args.db)
+    from sqlalchemy import insert
+    from models import db, User, Task
+    import rollup
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    with app.app_context():
+        user_ids = []
+        for i in range(args.users):
+            user = User.query.filter_by(email=user_email(i)).first()
+            if user is None:
+                user = User(full_name=f'Bench User {i}', email=user_email(i))
+                user.set_password(PASSWORD)
+                db.session.add(user)
+                db.session.flush()
+            user_ids.append(user.id)
+        db.session.commit()
+        batch = []
+        started = time.perf_counter()
+        for n in range(args.tasks):
+            project_cost = rng.randrange(0, 100000)
+            batch.append({
+                'user_id': user_ids[n % len(user_ids)],
+                'task': rng.choice(TASK_TYPES),
+                'owner': rng.choice(OWNERS),
+                'contact': f'{rng.choice(OWNERS)}@example.com',
+                'summary': f'Synthetic task {n}',
+                'phone': f'555-{n % 10000:04d}',
+                'site_name': f'Site {rng.randrange(args.sites)}',
+                'status': rng.choice(STATUSES),
+                'project_cost': project_cost,
+                'execution_cost': rng.randrange(0, project_cost + 1),
+                # Spread over two years so /budget has data in several months
+                'created_at': now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60)),
+            })
+            if len(batch) >= args.batch_size:
+                db.session.execute(insert(Task), batch)
+                db.session.commit()
+                batch.clear()
+                print(f'  {n + 1} tasks', end='\r', flush=True)
+        if batch:
+            db.session.execute(insert(Task), batch)
+            db.session.commit()
+        # Core inserts skip the session hooks that maintain the budget rollup
+        rollup.rebuild()
+        db.session.commit()
+        print(f'\nSeeded {args.tasks} tasks for {args.users} users in {time.perf_counter() - started:.1f}s')
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+
+class HTTPSession:
+    def __init__(self, base_url, headers=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers or {}
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=dict(self.headers))
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+
+def scenario_request(name, rng):
+    method, path, _ = SCENARIOS[name]
+    if name == 'search':
+        return method, path.format(term=urllib.request.quote(rng.choice(SEARCH_TERMS))), None
+    if name == 'add':
+        return method, path, {
+            'task': rng.choice(TASK_TYPES), 'owner': rng.choice(OWNERS), 'contact': 'bench@example.com',
+            'site_name': f'Site {rng.randrange(1000)}', 'project_cost': rng.randrange(100000), 'execution_cost': 0,
+        }
+    if name == 'chatbot':
+        message = rng.choice(('how do i edit a task', 'what is your name', 'hello'))
+        return method, path, {'message': message, 'chatbot_state': None, 'chatbot_mode': 'step'}
+    return method, path, None
+
+
+def scrape_queries(session, token=None):
+    """{metrics endpoint label: (sum of queries, request count)} from /metrics."""
+    path = '/metrics'
+    if isinstance(session, HTTPSession):
+        session = HTTPSession(session.base_url, {'Authorization': f'Bearer {token}'} if token else None)
+        status, body = session.request('GET', path)
+    else:
+        response = session.client.get(path, headers={'Authorization': f'Bearer {token}'} if token else None)
+        status, body = response.status_code, response.get_data()
+    if status != 200:
+        return {}
+    totals = {}
+    for line in body.decode().splitlines():
+        m = re.match(r'junate_db_queries_per_request_(sum|count)\{endpoint="([^"]+)"\} (\S+)', line)
+        if m:
+            kind, endpoint, value = m.groups()
+            entry = totals.setdefault(endpoint, [0.0, 0.0])
+            entry[0 if kind == 'sum' else 1] = float(value)
+    return totals
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(name, sessions, requests_per_scenario, seed_value):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    counter = iter(range(requests_per_scenario))
+
+    def worker(index, session):
+        nonlocal errors
+        rng = random.Random(seed_value + index)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            method, path, body = scenario_request(name, rng)
+            started = time.perf_counter()
+            status, _ = session.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, args=(i, s)) for i, s in enumerate(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def run(args):
+    if args.url:
+        make_session = lambda: HTTPSession(args.url)
+        target = args.url
+    else:
+        app = load_app(args.db)
+        make_session = lambda: TestClientSession(app)
+        target = os.path.abspath(args.db)
+    sessions = []
+    for i in range(args.concurrency):
+        session = make_session()
+        status, body = session.request('POST', '/login', {'email': user_email(i % args.users), 'password': PASSWORD})
+        if status != 200:
+            sys.exit(f'Login failed for {user_email(i % args.users)} ({status}): {body[:200]!r}; run "seed" first')
+        sessions.append(session)
+    results = {}
+    for name in args.scenarios:
+        # Warm caches and connections so the first requests do not skew the percentiles
+        for session in sessions:
+            method, path, body = scenario_request(name, random.Random(args.seed))
+            session.request(method, path, body)
+        before = scrape_queries(sessions[0], args.metrics_token)
+        stats = run_scenario(name, sessions, args.requests, args.seed)
+        after = scrape_queries(sessions[0], args.metrics_token)
+        label = SCENARIOS[name][2]
+        if label in after:
+            queries = after[label][0] - before.get(label, [0.0, 0.0])[0]
+            count = after[label][1] - before.get(label, [0.0, 0.0])[1]
+            stats['queries_per_request'] = queries / count if count else None
+        results[name] = stats
+        print(f'{name:>13}: {stats["rps"]:8.1f} req/s  p50 {stats["p50_ms"]:7.1f} ms  p95 {stats["p95_ms"]:7.1f} ms  '
+              f'p99 {stats["p99_ms"]:7.1f} ms  queries/req {stats.get("queries_per_request") or 0:5.1f}  errors {stats["errors"]}')
+    report = {
+        'target': target,
+        'mode': 'http' if args.url else 'test-client',
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+
+
+def compare(args):
+    with open(args.results) as f:
+        current = json.load(f)['results']
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = 0
+    print(f'{"scenario":>13}  {"p95 base":>9}  {"p95 now":>9}  {"change":>7}  {"rps base":>9}  {"rps now":>9}  {"change":>7}')
+    for name, now in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        p95_change = (now['p95_ms'] - base['p95_ms']) * 100 / base['p95_ms'] if base['p95_ms'] else 0.0
+        rps_change = (now['rps'] - base['rps']) * 100 / base['rps'] if base['rps'] else 0.0
+        regressed = p95_change > args.threshold or rps_change < -args.threshold
+        regressions += regressed
+        print(f'{name:>13}  {base["p95_ms"]:9.1f}  {now["p95_ms"]:9.1f}  {p95_change:+6.1f}%  '
+              f'{base["rps"]:9.1f}  {now["rps"]:9.1f}  {rps_change:+6.1f}%{"  REGRESSION" if regressed else ""}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Create synthetic users and tasks')
+    seed_parser.add_argument('--db', default='bench.db')
+    seed_parser.add_argument('--users', type=int, default=10)
+    seed_parser.add_argument('--tasks', type=int, default=10000)
+    seed_parser.add_argument('--sites', type=int, default=1000)
+    seed_parser.add_argument('--batch-size', type=int, default=5000)
+    seed_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = commands.add_parser('run', help='Drive the endpoints and report latency and throughput')
+    run_parser.add_argument('--db', default='bench.db', help='Seeded database for in-process runs')
+    run_parser.add_argument('--url', help='Benchmark a running server over HTTP instead')
+    run_parser.add_argument('--users', type=int, default=10, help='Number of seeded users to log in as')
+    run_parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    run_parser.add_argument('--concurrency', type=int, default=4)
+    run_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument('--metrics-token')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', help='Write results as JSON')
+
+    compare_parser = commands.add_parser('compare', help='Compare results against a baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--baseline', required=True)
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='Percent p95 increase or throughput drop counted as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args)
+    elif args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, request
+from flask_login import current_user
+from conditional import app_version, data_version
+
+
+class LRUCache:
+    """Thread-safe in-process cache with a size bound and per-entry TTL."""
+
+    def __init__(self, maxsize=512, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Counters are kept apart from the LRU entries: evicting one would
+    # resurrect entries written under an older generation
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def hit(self, key, ttl):
+        """Count a hit in a fixed window that starts at the first hit and lasts ``ttl`` seconds."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            expires_at, count = entry if entry is not None and entry[0] >= now else (now + ttl, 0)
+            self._entries[key] = (expires_at, count + 1)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return count + 1
+
+
+class RedisCache:
+    """Same interface as LRUCache, backed by Redis or any server speaking its protocol."""
+
+    def __init__(self, url, ttl=60, prefix='junate:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def hit(self, key, ttl):
+        count = self.client.incr(self.prefix + key)
+        if count == 1:
+            self.client.expire(self.prefix + key, ttl)
+        return count
+
+
+def create_cache(url=None, maxsize=512, ttl=60):
+    # 'memory://' (default) or 'redis://host:port/db'
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(url, ttl=ttl)
+    return LRUCache(maxsize=maxsize, ttl=ttl)
+
+
+class ResponseCache:
+    """Caches rendered responses per owner and answers If-None-Match with 304.
+
+    Entries are keyed by the owner's ``User.data_version``, read through
+    the same session (and so the same bind) that renders the page: a page
+    rendered from a lagging replica is stored under the version it shows,
+    and is no longer served once the replica has caught up. A streamed
+    page is passed through on a miss and cached once it has been sent in
+    full; later hits carry the ETag.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache()
+
+    def init_app(self, app):
+        self.backend = create_cache(app.config.get('VISITOR_CACHE_URL'),
+                                    maxsize=app.config.get('VISITOR_CACHE_SIZE', 512),
+                                    ttl=app.config.get('VISITOR_CACHE_TTL', 60))
+
+    def _key(self, user_id):
+        return f'visitor:{app_version()}:{user_id}:{data_version(user_id)}:{request.full_path}'
+
+    @staticmethod
+    def _entry(body, mimetype):
+        return {'body': body.decode('utf-8'), 'etag': hashlib.sha1(body).hexdigest(), 'mimetype': mimetype}
+
+    def _tee(self, key, mimetype, chunks):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+        # Only reached when the whole page was sent; an aborted stream is never cached
+        self.backend.set(key, self._entry(b''.join(parts), mimetype))
+
+    def cached(self, view):
+        """Cache a ``/view/<user_id>/...`` route for anonymous visitors."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages show the signed-in viewer's name, so only anonymous hits are shared
+            if current_user.is_authenticated:
+                return view(*args, **kwargs)
+            key = self._key(kwargs['user_id'])
+            entry = self.backend.get(key)
+            if entry is None:
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response):
+                    response = Response(response)
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    # Send the stream as it is rendered and cache the page once it has completed
+                    response.response = self._tee(key, response.mimetype, response.response)
+                    response.headers['Cache-Control'] = 'no-cache'
+                    response.vary.add('Cookie')
+                    return response
+                body = response.get_data()
+                entry = self._entry(body, response.mimetype)
+                self.backend.set(key, entry)
+            response = Response(entry['body'], mimetype=entry['mimetype'])
+            response.set_etag(entry['etag'])
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
+
+
+visitor_cache = ResponseCache()
@@ -1,190 +1,273 @@
-from flask import Blueprint, request, jsonify
+import re
+from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from models import db, Task
+from intents import intent_engine
+from conversations import conversations
+
+# Natural language field extractors, compiled once at import
+SITE_PATTERNS = (
+    re.compile(r'(?:site name|site)\s*[:=]?\s*([\w\s\-]+?)(?:,|$)', re.IGNORECASE),
+    re.compile(r'at ([\w\s\-]+?)(?:,|$)', re.IGNORECASE),
+)
+OWNER_PATTERN = re.compile(r'(?:owner)\s*[:=]?\s*([\w\s\-]+?)(?:,|$)', re.IGNORECASE)
+CONTACT_PATTERN = re.compile(r'(?:contact|email)\s*[:=]?\s*([\w\.-]+@[\w\.-]+)', re.IGNORECASE)
+PHONE_PATTERN = re.compile(r'(?:phone|number)\s*[:=]?\s*([\d\-\+\s]+)', re.IGNORECASE)
+SUMMARY_PATTERN = re.compile(r'(?:summary|comment)\s*[:=]?\s*([\w\s\-\.]+)', re.IGNORECASE)
+PROJECT_COST_PATTERN = re.compile(r'(?:project\s*cost|project_cost|projectcost)\s*[:=]?\s*(\d+)', re.IGNORECASE)
+EXECUTION_COST_PATTERN = re.compile(r'(?:execution\s*cost|execution_cost|executioncost)\s*[:=]?\s*(\d+)', re.IGNORECASE)
+# Longest option first, so 'Decommission and Retrieval' is not read as 'Decommission'
+TASK_TYPE_PATTERN = re.compile(
+    '|'.join(re.escape(opt) for opt in sorted(intent_engine.task_types, key=len, reverse=True)), re.IGNORECASE
+)
+
+
+def extract(patterns, text):
+    for pattern in patterns:
+        m = pattern.search(text)
+        if m:
+            return m.group(1).strip()
+    return None
+
+
+def extract_int(pattern, text):
+    m = pattern.search(text)
+    if not m:
+        return None
+    try:
+        val = int(m.group(1))
+        return val if val >= 0 else 0
+    except Exception:
+        return None
+
+
+def extract_task_type(text):
+    m = TASK_TYPE_PATTERN.search(text)
+    if not m:
+        return None
+    # Report the canonical spelling, whatever case the user typed
+    return next(opt for opt in intent_engine.task_types if opt.lower() == m.group(0).lower())
+
+
+# Free-text steps: step -> (task field, next step, next prompt)
+TEXT_STEPS = {
+    'awaiting_site_name': ('site_name', 'awaiting_task_type', 'What is the Task Type?\nOptions: ' + ', '.join(intent_engine.task_types)),
+    'awaiting_owner': ('owner', 'awaiting_contact', 'What is the Contact Email?'),
+    'awaiting_contact': ('contact', 'awaiting_phone', 'What is the Phone Number?'),
+    'awaiting_phone': ('phone', 'awaiting_summary', 'Please provide a Task Summary (or type "skip"):'),
+    'awaiting_summary': ('summary', 'awaiting_project_cost', 'What is the Project Cost? (integer, type "skip" for 0)'),
+}
+
+
+def parse_step_cost(text):
+    # 'skip', blank or anything that is not an integer counts as 0; negatives clamp to 0
+    try:
+        val = int(text.strip())
+    except ValueError:
+        return 0
+    return val if val >= 0 else 0
+
+
+# Records in a pasted block are separated by ';' or line breaks
+RECORD_SEPARATOR = re.compile(r'[;\n]+')
+REQUIRED_RECORD_FIELDS = (
+    ('site_name', 'site name'),
+    ('task', 'task type'),
+    ('owner', 'owner'),
+    ('contact', 'contact email'),
+    ('phone', 'phone number'),
+)
+
+
+def split_records(text):
+    """Split a pasted block into one chunk per task; returns ``(chunks, ambiguous)``.
+
+    A chunk naming a site or task type starts a task. Chunks naming neither
+    continue the task before them when they hold other fields (a wrapped
+    "owner ..., contact ..." line) and are otherwise header or footer text
+    ("Please add these:", "thanks!") and dropped. A block with at most one
+    site and one task type is a single task, whatever its line breaks. The
+    split is ``ambiguous`` when some chunk names only one of the two: it may
+    be half of a wrapped task, so the caller confirms before creating them.
+    """
+    chunks, sites, task_types, complete = [], 0, 0, True
+    for chunk in (chunk.strip() for chunk in RECORD_SEPARATOR.split(text)):
+        has_site = extract(SITE_PATTERNS, chunk) is not None
+        has_task_type = extract_task_type(chunk) is not None
+        if has_site or has_task_type:
+            chunks.append(chunk)
+            sites += has_site
+            task_types += has_task_type
+            complete = complete and has_site and has_task_type
+        elif chunks and any(parse_record(chunk).values()):
+            chunks[-1] += ', ' + chunk
+    if sites <= 1 and task_types <= 1:
+        return [text], False
+    return chunks, not complete
+
+
+def parse_record(text):
+    """Extract one task's fields from natural language; missing required fields are None."""
+    return {
+        'site_name': extract(SITE_PATTERNS, text),
+        'task': extract_task_type(text),
+        'owner': extract((OWNER_PATTERN,), text),
+        'contact': extract((CONTACT_PATTERN,), text),
+        'phone': extract((PHONE_PATTERN,), text),
+        # summary is optional, costs default to 0
+        'summary': extract((SUMMARY_PATTERN,), text) or '',
+        'project_cost': extract_int(PROJECT_COST_PATTERN, text) or 0,
+        'execution_cost': extract_int(EXECUTION_COST_PATTERN, text) or 0,
+    }
+
+
+def validate_record(record):
+    """Return an error message for a parsed record, or None if it can be saved."""
+    missing = [label for field, label in REQUIRED_RECORD_FIELDS if not record[field]]
+    if missing:
+        return 'missing ' + ', '.join(missing)
+    for field in ('site_name', 'owner', 'contact', 'phone', 'summary'):
+        limit = Task.__table__.c[field].type.length
+        if limit and len(record[field]) > limit:
+            return f'{field.replace("_", " ")} is longer than {limit} characters'
+    return None
+
+
+def _create_batch(chunks):
+    max_records = current_app.config.get('CHATBOT_BATCH_MAX', 100)
+    if len(chunks) > max_records:
+        return jsonify({'reply': f'Please send at most {max_records} tasks per message.', 'next_state': {'mode': 'nlp'}})
+    records, errors = [], []
+    for number, chunk in enumerate(chunks, start=1):
+        record = parse_record(chunk)
+        error = validate_record(record)
+        if error:
+            errors.append(f'Task {number}: {error}')
+        else:
+            records.append(record)
+    if errors:
+        # All or nothing, so the corrected list can be pasted again without duplicates
+        reply = 'No tasks were added. Please fix these and send the list again:\n' + '\n'.join(errors)
+        return jsonify({'reply': reply, 'next_state': {'mode': 'nlp'}})
+    tasks = [Task(user_id=current_user.id, **record) for record in records]
+    # One transaction; the flush batches the INSERTs
+    db.session.add_all(tasks)
+    db.session.commit()
+    lines = [f"- '{t.task}' for site '{t.site_name}' (owner {t.owner})" for t in tasks]
+    return jsonify({'reply': f'Created {len(tasks)} tasks:\n' + '\n'.join(lines), 'next_state': None})
+
+
+def _step_reply(reply, conversation):
+    conversations.save(conversation)
+    return jsonify({'reply': reply, 'next_state': {'step': conversation['step']}})
 
 
 chatbot_bp = Blueprint('chatbot', __name__)
 @chatbot_bp.route('/chatbot', methods=['POST'])
 @login_required
 def chatbot():
-    import re
     data = request.json
     user_message = data.get('message', '').strip()
     state = data.get('chatbot_state') or {}
+    if not isinstance(state, dict):
+        state = {}
     mode = data.get('chatbot_mode', 'step')
-    # Task type options
-    task_type_options = [
-        'Decommission',
-        'Decommission and Retrieval',
-        'Infra Works',
-        'Relocation'
-    ]
+    task_type_options = intent_engine.task_types
     # --- Natural Language Mode ---
     if mode == 'nlp':
+        if state.get('step') == 'confirm_batch':
+            conversation = conversations.load()
+            if conversation is None:
+                return jsonify({'reply': 'This list has expired. Please send it again.', 'next_state': {'mode': 'nlp'}})
+            conversations.finish(conversation)
+            if user_message.lower() in ('yes', 'y', 'confirm'):
+                return _create_batch(conversation['data']['chunks'])
+            return jsonify({'reply': 'No tasks were added. Please send one task per line.', 'next_state': {'mode': 'nlp'}})
+        # A pasted list ("site A, Relocation, owner X ...; site B, ...") creates every task at once
+        chunks, ambiguous = split_records(user_message)
+        if ambiguous:
+            conversation = conversations.start('confirm_batch')
+            conversation['data']['chunks'] = chunks
+            lines = '\n'.join(f'{number}. {chunk}' for number, chunk in enumerate(chunks, start=1))
+            return _step_reply(f'{len(chunks)} of these lines look like tasks:\n{lines}\nConfirm? (yes/no)', conversation)
+        if len(chunks) > 1:
+            return _create_batch(chunks)
         # Try to extract all fields from the message
-        def extract(pattern, text):
-            m = re.search(pattern, text, re.IGNORECASE)
-            return m.group(1).strip() if m else None
-        # Try to find each field
-        site_name = extract(r'(?:site name|site)\s*[:=]?\s*([\w\s\-]+?)(?:,|$)', user_message) or extract(r'at ([\w\s\-]+?)(?:,|$)', user_message)
-        task_type = None
-        for opt in task_type_options:
-            if re.search(re.escape(opt), user_message, re.IGNORECASE):
-                task_type = opt
-                break
-        owner = extract(r'(?:owner)\s*[:=]?\s*([\w\s\-]+?)(?:,|$)', user_message)
-        contact = extract(r'(?:contact|email)\s*[:=]?\s*([\w\.-]+@[\w\.-]+)', user_message)
-        phone = extract(r'(?:phone|number)\s*[:=]?\s*([\d\-\+\s]+)', user_message)
-        summary = extract(r'(?:summary|comment)\s*[:=]?\s*([\w\s\-\.]+)', user_message)
-        # Optional numeric costs
-        def extract_int(pattern, text):
-            m = re.search(pattern, text, re.IGNORECASE)
-            if not m:
-                return None
-            try:
-                val = int(m.group(1))
-                return val if val >= 0 else 0
-            except Exception:
-                return None
-        project_cost = extract_int(r'(?:project\s*cost|project_cost|projectcost)\s*[:=]?\s*(\d+)', user_message)
-        execution_cost = extract_int(r'(?:execution\s*cost|execution_cost|executioncost)\s*[:=]?\s*(\d+)', user_message)
+        record = parse_record(user_message)
         # Prompt for missing fields
-        if not site_name:
+        if not record['site_name']:
             return jsonify({'reply': 'What is the Site Name?', 'next_state': {'mode': 'nlp'}})
-        if not task_type:
-            return jsonify({'reply': 'What is the Task Type?\nOptions: ' + ', '.join(task_type_options), 'next_state': {'mode': 'nlp', 'site_name': site_name}})
-        if not owner:
-            return jsonify({'reply': 'Who is the Owner?', 'next_state': {'mode': 'nlp', 'site_name': site_name, 'task': task_type}})
-        if not contact:
-            return jsonify({'reply': 'What is the Contact Email?', 'next_state': {'mode': 'nlp', 'site_name': site_name, 'task': task_type, 'owner': owner}})
-        if not phone:
-            return jsonify({'reply': 'What is the Phone Number?', 'next_state': {'mode': 'nlp', 'site_name': site_name, 'task': task_type, 'owner': owner, 'contact': contact}})
-        # summary is optional
-        if not summary:
-            summary = ''
-        # default costs to 0 if not provided
-        if project_cost is None:
-            project_cost = 0
-        if execution_cost is None:
-            execution_cost = 0
+        if not record['task']:
+            return jsonify({'reply': 'What is the Task Type?\nOptions: ' + ', '.join(task_type_options), 'next_state': {'mode': 'nlp'}})
+        if not record['owner']:
+            return jsonify({'reply': 'Who is the Owner?', 'next_state': {'mode': 'nlp'}})
+        if not record['contact']:
+            return jsonify({'reply': 'What is the Contact Email?', 'next_state': {'mode': 'nlp'}})
+        if not record['phone']:
+            return jsonify({'reply': 'What is the Phone Number?', 'next_state': {'mode': 'nlp'}})
+        error = validate_record(record)
+        if error:
+            return jsonify({'reply': error[0].upper() + error[1:] + '.', 'next_state': {'mode': 'nlp'}})
         # All info collected, create the task
-        new_task = Task(
-            site_name=site_name,
-            task=task_type,
-            owner=owner,
-            contact=contact,
-            phone=phone,
-            summary=summary,
-            project_cost=project_cost,
-            execution_cost=execution_cost,
-            user_id=current_user.id
-        )
+        new_task = Task(user_id=current_user.id, **record)
         db.session.add(new_task)
         db.session.commit()
         reply = f"Task '{new_task.task}' for site '{new_task.site_name}' created!"
         return jsonify({'reply': reply, 'next_state': None})
     # --- Step-by-Step Mode ---
+    # Collected fields live in the server-side store; the client only echoes the step back
+    conversation = conversations.load() if state.get('step') else None
+    if state.get('step') and conversation is None:
+        return jsonify({'reply': 'This conversation has expired. Say "create task" to start again.', 'next_state': None})
+    step = conversation['step'] if conversation else None
     # Multi-step task creation in correct order
-    if state.get('step') == 'awaiting_site_name':
-        state['data']['site_name'] = user_message
-        reply = 'What is the Task Type?\nOptions: ' + ', '.join(task_type_options)
-        state['step'] = 'awaiting_task_type'
-        return jsonify({'reply': reply, 'next_state': state})
-    elif state.get('step') == 'awaiting_task_type':
+    if step in TEXT_STEPS:
+        field, next_step, reply = TEXT_STEPS[step]
+        if step == 'awaiting_summary' and user_message.lower() == 'skip':
+            user_message = ''
+        limit = Task.__table__.c[field].type.length
+        if limit and len(user_message) > limit:
+            return _step_reply(f'That is too long; please keep it under {limit} characters.', conversation)
+        conversation['data'][field] = user_message
+        conversation['step'] = next_step
+        return _step_reply(reply, conversation)
+    elif step == 'awaiting_task_type':
         if user_message not in task_type_options:
             reply = 'Invalid Task Type. Please choose one of the following:\n' + ', '.join(task_type_options)
-            return jsonify({'reply': reply, 'next_state': state})
-        state['data']['task'] = user_message
-        reply = 'Who is the Owner?'
-        state['step'] = 'awaiting_owner'
-        return jsonify({'reply': reply, 'next_state': state})
-    elif state.get('step') == 'awaiting_owner':
-        state['data']['owner'] = user_message
-        reply = 'What is the Contact Email?'
-        state['step'] = 'awaiting_contact'
-        return jsonify({'reply': reply, 'next_state': state})
-    elif state.get('step') == 'awaiting_contact':
-        state['data']['contact'] = user_message
-        reply = 'What is the Phone Number?'
-        state['step'] = 'awaiting_phone'
-        return jsonify({'reply': reply, 'next_state': state})
-    elif state.get('step') == 'awaiting_phone':
-        state['data']['phone'] = user_message
-        reply = 'Please provide a Task Summary (or type "skip"):'
-        state['step'] = 'awaiting_summary'
-        return jsonify({'reply': reply, 'next_state': state})
-    elif state.get('step') == 'awaiting_summary':
-        summary = user_message if user_message.lower() != 'skip' else ''
-        state['data']['summary'] = summary
-        # Ask for Project Cost (integer, default 0)
-        state['step'] = 'awaiting_project_cost'
-        return jsonify({'reply': 'What is the Project Cost? (integer, type "skip" for 0)', 'next_state': state})
-    elif state.get('step') == 'awaiting_project_cost':
-        txt = user_message.strip().lower()
-        if txt == 'skip' or txt == '':
-            state['data']['project_cost'] = 0
-        else:
-            try:
-                val = int(user_message.strip())
-                state['data']['project_cost'] = val if val >= 0 else 0
-            except Exception:
-                state['data']['project_cost'] = 0
-        state['step'] = 'awaiting_execution_cost'
-        return jsonify({'reply': 'What is the Execution Cost? (integer, type "skip" for 0)', 'next_state': state})
-    elif state.get('step') == 'awaiting_execution_cost':
-        txt = user_message.strip().lower()
-        if txt == 'skip' or txt == '':
-            state['data']['execution_cost'] = 0
-        else:
-            try:
-                val = int(user_message.strip())
-                state['data']['execution_cost'] = val if val >= 0 else 0
-            except Exception:
-                state['data']['execution_cost'] = 0
+            return _step_reply(reply, conversation)
+        conversation['data']['task'] = user_message
+        conversation['step'] = 'awaiting_owner'
+        return _step_reply('Who is the Owner?', conversation)
+    elif step == 'awaiting_project_cost':
+        conversation['data']['project_cost'] = parse_step_cost(user_message)
+        conversation['step'] = 'awaiting_execution_cost'
+        return _step_reply('What is the Execution Cost? (integer, type "skip" for 0)', conversation)
+    elif step == 'awaiting_execution_cost':
+        data = conversation['data']
+        data['execution_cost'] = parse_step_cost(user_message)
         # All info collected, create the task
         new_task = Task(
-            site_name=state['data']['site_name'],
-            task=state['data']['task'],
-            owner=state['data']['owner'],
-            contact=state['data']['contact'],
-            phone=state['data']['phone'],
-            summary=state['data']['summary'],
-            project_cost=state['data'].get('project_cost', 0),
-            execution_cost=state['data'].get('execution_cost', 0),
+            site_name=data['site_name'],
+            task=data['task'],
+            owner=data['owner'],
+            contact=data['contact'],
+            phone=data['phone'],
+            summary=data['summary'],
+            project_cost=data.get('project_cost', 0),
+            execution_cost=data.get('execution_cost', 0),
             user_id=current_user.id
         )
         db.session.add(new_task)
         db.session.commit()
+        conversations.finish(conversation)
         reply = f"Task '{new_task.task}' for site '{new_task.site_name}' created!"
         return jsonify({'reply': reply, 'next_state': None})
     # --- Instructional Responses ---
-    help_intents = [
-        (['how do i create a task', 'how to create a task', 'create task manually', 'add task manually'],
-         "To create a new task: Click on the 'Add Task' button or navigate to the task creation section. Enter the task details such as title, description, and due date, then click 'Save' or 'Create'. Your new task will appear in the task list."),
-        (['how do i delete a task', 'how to delete a task', 'remove a task', 'delete task'],
-         "To delete a task: Find the task you want to remove in your task list. Click the 'Delete' button (usually a trash can icon) next to the task. Confirm the deletion if prompted. The task will be permanently removed."),
-        (['how do i edit a task', 'how to edit a task', 'edit task', 'modify a task'],
-         "To edit a task: Locate the task you wish to modify. Click the 'Edit' button (often a pencil icon) next to the task. Update the task details as needed, then click 'Save' to apply your changes."),
-        (['how do i view a task', 'how to view a task', 'view task', 'see task details'],
-         "To view a task: Browse your task list and click on the task you want to view. This will display the full details of the task, including its description, due date, and status."),
-        (['how do i save a task', 'how to save a task', 'save task'],
-         "To save a task: After entering or editing task details, click the 'Save' button. This will store your changes and update the task list accordingly.")
-    ]
-    name_intents = ['what is your name', "what's your name", 'who are you', 'your name']
-    
-    # Check for instructional intents
-    lower_msg = user_message.lower()
-    for triggers, response in help_intents:
-        if any(trigger in lower_msg for trigger in triggers):
-            return jsonify({'reply': response, 'next_state': None})
-    if any(name in lower_msg for name in name_intents):
-        return jsonify({'reply': "My name is Junate, your assistant for managing tasks efficiently!", 'next_state': None})
-    
-    # Start task creation if 
-    message_options = ['create task', 'add task', 'create a task', 'add a task', 'please create me a task', 'I want to create a task']
-    if any(option in user_message.lower() for option in message_options):   
-        reply = 'What is the Site Name?'
-        state = {'step': 'awaiting_site_name', 'data': {}}
-        return jsonify({'reply': reply, 'next_state': state})
+    # One pass over the message for every intent in intents.json
+    intent = intent_engine.match(user_message)
+    if intent is not None and intent.action == 'start_task':
+        return _step_reply('What is the Site Name?', conversations.start('awaiting_site_name'))
+    if intent is not None:
+        return jsonify({'reply': intent.reply, 'next_state': None})
     # Default reply
-    return jsonify({'reply': "Hi, it's your boy, Junate! Ask me to create a task or help with your dashboard.", 'next_state': None})
+    return jsonify({'reply': intent_engine.fallback, 'next_state': None})
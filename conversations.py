@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import session
+from flask_login import current_user
+from sqlalchemy import delete
+from cache import create_cache
+from models import db, ChatbotConversation
+
+
+class DatabaseBackend:
+    """Cache-like store in the ChatbotConversation table, shared by every gunicorn worker.
+
+    Each write also deletes expired rows, so abandoned
+    conversations do not pile up.
+    """
+
+    def __init__(self, ttl=900):
+        self.ttl = ttl
+
+    def get(self, key):
+        row = db.session.get(ChatbotConversation, key)
+        if row is None or row.expires_at < datetime.utcnow():
+            return None
+        return json.loads(row.state)
+
+    def set(self, key, value):
+        now = datetime.utcnow()
+        db.session.execute(delete(ChatbotConversation).where(ChatbotConversation.expires_at < now))
+        db.session.merge(ChatbotConversation(key=key, state=json.dumps(value), expires_at=now + timedelta(seconds=self.ttl)))
+        db.session.commit()
+
+    def delete(self, key):
+        db.session.execute(delete(ChatbotConversation).where(ChatbotConversation.key == key))
+        db.session.commit()
+
+
+class ConversationStore:
+    """Server-side state for step-by-step chatbot conversations.
+
+    The client only echoes back the current step; the collected fields
+    stay here, keyed by user and browser session. Each message refreshes
+    the TTL, so abandoned conversations expire on their own.
+
+    ``CHATBOT_STATE_URL`` picks the backend: ``db://`` (the default)
+    keeps them in the ChatbotConversation table and ``redis://`` in Redis,
+    both visible to every gunicorn worker; ``memory://`` is per process
+    and only suits a single-process server.
+    """
+
+    def __init__(self):
+        self.backend = DatabaseBackend()
+        self._lock = threading.Lock()
+        self._stats = {
+            'started': 0,
+            'completed': 0,
+            'expired': 0,
+            'messages': 0,
+            'completed_seconds_total': 0.0,
+        }
+
+    def init_app(self, app):
+        url = app.config.get('CHATBOT_STATE_URL') or 'db://'
+        ttl = app.config.get('CHATBOT_STATE_TTL', 900)
+        if url.startswith('db://'):
+            self.backend = DatabaseBackend(ttl=ttl)
+            return
+        if url.startswith('memory://'):
+            app.logger.warning('CHATBOT_STATE_URL is memory://: chatbot conversations are per process and '
+                               'expire when a message reaches another worker; use db:// or redis:// '
+                               'with more than one worker')
+        self.backend = create_cache(url, maxsize=app.config.get('CHATBOT_STATE_SIZE', 1024), ttl=ttl)
+
+    def _key(self):
+        conversation_id = session.get('chatbot_conversation')
+        if conversation_id is None:
+            conversation_id = session['chatbot_conversation'] = uuid.uuid4().hex
+        return f'chat:{current_user.id}:{conversation_id}'
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def load(self):
+        conversation = self.backend.get(self._key())
+        self._count('messages' if conversation is not None else 'expired')
+        return conversation
+
+    def start(self, step):
+        conversation = {'step': step, 'data': {}, 'started_at': time.time()}
+        self.save(conversation)
+        self._count('started')
+        return conversation
+
+    def save(self, conversation):
+        self.backend.set(self._key(), conversation)
+
+    def finish(self, conversation):
+        self.backend.delete(self._key())
+        self._count('completed')
+        self._count('completed_seconds_total', time.time() - conversation['started_at'])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+conversations = ConversationStore()
@@ -0,0 +1,86 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, default) not in ('0', 'false', 'False', '')
+
+
+def _normalise_uri(uri):
+    # Supabase/Heroku style URLs use the scheme SQLAlchemy 1.4+ no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def database_uri():
+    return _normalise_uri(os.environ.get('SUPABASE_DATABASE_URL', 'sqlite:///tasks.db'))
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``uri``, tuned from DB_* environment variables."""
+    if uri.startswith('sqlite'):
+        # Seconds the driver waits on a locked database before raising "database is locked"
+        return {'connect_args': {'timeout': _env_int('DB_SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+    options = {'pool_pre_ping': _env_flag('DB_POOL_PRE_PING', '1')}
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+    if _env_flag('DB_PGBOUNCER', '0'):
+        # PgBouncer owns the pool; holding our own idle connections would only pin server slots.
+        # Startup 'options' are rejected in transaction pooling mode, so the statement
+        # timeout is applied per transaction by register_engine_events() instead.
+        options['poolclass'] = NullPool
+    else:
+        options.update(
+            pool_size=_env_int('DB_POOL_SIZE', 5),
+            max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+            pool_timeout=_env_int('DB_POOL_TIMEOUT', 30),
+            # Recycle before server/load balancer idle timeouts close the socket under us
+            pool_recycle=_env_int('DB_POOL_RECYCLE', 1800),
+            pool_use_lifo=True,
+        )
+        if statement_timeout:
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+def configure_app(app):
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    # Optional read replica; replica.RoutingSession sends @read_replica views to it
+    replica_uri = os.environ.get('SUPABASE_REPLICA_URL')
+    if replica_uri:
+        replica_uri = _normalise_uri(replica_uri)
+        app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_uri, **engine_options(replica_uri)}}
+
+
+def register_engine_events(engine):
+    """Per-connection settings that cannot be expressed as engine options."""
+    if engine.dialect.name == 'sqlite':
+        journal_mode = os.environ.get('DB_SQLITE_JOURNAL_MODE', 'WAL')
+        synchronous = os.environ.get('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+        mmap_size = _env_int('DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+        busy_timeout = _env_int('DB_SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+        @event.listens_for(engine, 'connect')
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # WAL lets readers proceed while a gunicorn worker writes
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+            cursor.execute(f'PRAGMA mmap_size={mmap_size}')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.close()
+    elif engine.dialect.name == 'postgresql' and _env_flag('DB_PGBOUNCER', '0'):
+        statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+        if statement_timeout:
+            @event.listens_for(engine, 'begin')
+            def _statement_timeout(connection):
+                # SET LOCAL lasts only for this transaction, so it never leaks to
+                # another client sharing the PgBouncer server connection
+                connection.exec_driver_sql(f'SET LOCAL statement_timeout = {statement_timeout}')
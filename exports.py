@@ -0,0 +1,204 @@
+import csv
+import functools
+import importlib.util
+import io
+import tempfile
+import zlib
+from flask import Response, current_app, request, stream_with_context
+from reports import iter_report_rows, report_totals, report_rollup, REPORT_GROUPS
+
+PROGRESS_HEADER = ['Site Name', 'Task', 'Owner', 'Status', 'Summary', 'Project Cost', 'Execution Cost', '% Profit']
+
+# Flush the CSV buffer to the client once it holds this many characters
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def iter_progress_rows(user_id, totals=False, **filters):
+    # Profit is computed by the report query; rows stream EXPORT_BATCH_SIZE at a time
+    for row in iter_report_rows(user_id, **filters):
+        yield row.site_name, row.task, row.owner, row.status, row.summary, row.project_cost, row.execution_cost, f'{row.profit_percent}%'
+    if totals:
+        total = report_totals(user_id, **filters)
+        yield 'Total', '', '', '', '', total.project_cost, total.execution_cost, f'{total.profit_percent}%'
+
+
+def rollup_header(group):
+    return ['Site Name' if group == 'site' else 'Status', 'Tasks', 'Project Cost', 'Execution Cost', 'Profit', '% Profit']
+
+
+def iter_rollup_rows(user_id, group, **filters):
+    for row in report_rollup(user_id, group, **filters):
+        yield row.group, row.tasks, row.project_cost, row.execution_cost, row.profit, f'{row.profit_percent}%'
+
+
+def progress_csv(user_id, group=None, totals=False, **filters):
+    """(filename, header, rows) of the progress CSV, or of its per-site/per-status rollup when ``group`` is set."""
+    if group in REPORT_GROUPS:
+        return f'progress_by_{group}.csv', rollup_header(group), iter_rollup_rows(user_id, group, **filters)
+    return 'progress_report.csv', PROGRESS_HEADER, iter_progress_rows(user_id, totals=totals, **filters)
+
+
+def iter_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_response(filename, header, rows):
+    """Stream ``rows`` as a CSV attachment, gzip-encoded when the client accepts it."""
+    body = iter_csv(header, rows)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Vary': 'Accept-Encoding',
+    }
+    if current_app.config.get('EXPORT_GZIP', True) and request.accept_encodings['gzip'] > 0:
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(body), mimetype='text/csv', headers=headers)
+
+
+# Typed exports (XLSX, Parquet, Arrow IPC). Costs and profit stay numbers and
+# created_at a timestamp, so analytics tools load them without re-parsing.
+# Each writer consumes reports.iter_report_batches() one cursor batch at a time.
+
+EXPORT_HEADER = ['Site Name', 'Task', 'Owner', 'Status', 'Summary', 'Project Cost', 'Execution Cost', 'Profit', '% Profit', 'Created']
+EXPORT_FIELDS = ('site_name', 'task', 'owner', 'status', 'summary',
+                 'project_cost', 'execution_cost', 'profit', 'profit_percent', 'created_at')
+
+# Read a finished XLSX workbook back to the client this many bytes at a time
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file whose bytes are handed to the client as soon as the writer produces them."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ('site_name', pa.string()),
+        ('task', pa.string()),
+        ('owner', pa.string()),
+        ('status', pa.string()),
+        ('summary', pa.string()),
+        ('project_cost', pa.int64()),
+        ('execution_cost', pa.int64()),
+        ('profit', pa.int64()),
+        ('profit_percent', pa.float64()),
+        ('created_at', pa.timestamp('us')),
+    ])
+
+
+def _record_batches(pa, schema, batches):
+    # Transpose each batch of Row tuples into columns: one pa.array per field
+    for rows in batches:
+        columns = dict(zip(rows[0]._fields, zip(*rows)))
+        yield pa.RecordBatch.from_arrays([pa.array(columns[field.name], type=field.type) for field in schema], schema=schema)
+
+
+def iter_parquet(batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(pa)
+    sink = _StreamSink()
+    # Cursor batches are small; gather them into row groups large enough to compress and scan well
+    row_group_size = current_app.config.get('EXPORT_ROW_GROUP_SIZE', 65536)
+    pending, pending_rows = [], 0
+    with pq.ParquetWriter(sink, schema, compression=current_app.config.get('EXPORT_PARQUET_COMPRESSION', 'zstd')) as writer:
+        for batch in _record_batches(pa, schema, batches):
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= row_group_size:
+                writer.write_table(pa.Table.from_batches(pending), row_group_size=pending_rows)
+                pending, pending_rows = [], 0
+                yield sink.drain()
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending), row_group_size=pending_rows)
+    yield sink.drain()
+
+
+def iter_arrow(batches):
+    import pyarrow as pa
+    schema = _arrow_schema(pa)
+    sink = _StreamSink()
+    # IPC stream format: no footer, so every batch goes out as soon as it is written
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in _record_batches(pa, schema, batches):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_xlsx(batches):
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    # Write-only mode spools rows to disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Progress Report')
+    sheet.append(EXPORT_HEADER)
+    for rows in batches:
+        for row in rows:
+            sheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+                          for value in (getattr(row, field) for field in EXPORT_FIELDS)])
+    # XLSX is a zip with its directory at the end, so it can only be sent once complete
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while chunk := f.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+# format -> (writer, mimetype, module it needs)
+EXPORT_FORMATS = {
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'openpyxl'),
+    'parquet': (iter_parquet, 'application/vnd.apache.parquet', 'pyarrow'),
+    'arrow': (iter_arrow, 'application/vnd.apache.arrow.stream', 'pyarrow'),
+}
+
+
+@functools.cache
+def available_formats():
+    """Typed export formats whose optional writer library is installed."""
+    return tuple(fmt for fmt, (_, _, module) in EXPORT_FORMATS.items() if importlib.util.find_spec(module))
+
+
+def export_response(filename, fmt, batches):
+    """Stream report ``batches`` as a ``fmt`` attachment (already compressed, so never gzip-encoded)."""
+    writer, mimetype, _ = EXPORT_FORMATS[fmt]
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    return Response(stream_with_context(writer(batches)), mimetype=mimetype, headers=headers)
@@ -0,0 +1,73 @@
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, User
+from cache import LRUCache, create_cache
+
+# session.info key holding the ids of users whose own row changed in the current transaction
+_CHANGED_IDENTITIES = 'changed_identity_ids'
+
+
+class SessionUser(UserMixin):
+    """What ``current_user`` needs from a User row; the password hash is never loaded."""
+
+    def __init__(self, id, full_name, email):
+        self.id = id
+        self.full_name = full_name
+        self.email = email
+
+
+class IdentityCache:
+    """Short-lived per-user identity cache behind Flask-Login's user_loader.
+
+    Authenticated requests resolve ``current_user`` without a database round
+    trip. Entries are keyed by a per-user generation counter, so a write to
+    the User row (password reset, profile change) invalidates them even if a
+    concurrent request re-populates the old values.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache(maxsize=1024, ttl=300)
+
+    def init_app(self, app):
+        self.backend = create_cache(app.config.get('IDENTITY_CACHE_URL'),
+                                    maxsize=app.config.get('IDENTITY_CACHE_SIZE', 1024),
+                                    ttl=app.config.get('IDENTITY_CACHE_TTL', 300))
+
+    def _key(self, user_id):
+        return f'identity:{user_id}:{self.backend.counter(f"identity-gen:{user_id}")}'
+
+    def load(self, user_id):
+        key = self._key(user_id)
+        entry = self.backend.get(key)
+        if entry is None:
+            row = db.session.execute(select(User.id, User.full_name, User.email).where(User.id == user_id)).first()
+            if row is None:
+                return None
+            entry = {'id': row.id, 'full_name': row.full_name, 'email': row.email}
+            self.backend.set(key, entry)
+        return SessionUser(**entry)
+
+    def invalidate(self, user_id):
+        self.backend.incr(f'identity-gen:{user_id}')
+
+
+identity_cache = IdentityCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_identities(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            session.info.setdefault(_CHANGED_IDENTITIES, set()).add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_identities(session):
+    for user_id in session.info.pop(_CHANGED_IDENTITIES, ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_identities(session):
+    session.info.pop(_CHANGED_IDENTITIES, None)
@@ -0,0 +1,89 @@
+import json
+import os
+from collections import deque
+
+INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json')
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton: finds every keyword occurring in a text in one pass.
+
+    Matching costs O(len(text) + matches) however many keywords were added,
+    so adding intents does not make each chatbot message slower.
+    """
+
+    def __init__(self, keywords):
+        # keywords: iterable of (keyword, value); matching is case-insensitive
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for keyword, value in keywords:
+            node = 0
+            for char in keyword.lower():
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(value)
+        # Breadth-first so a node's failure link is final before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, text):
+        """Yield the value of every keyword occurrence in ``text``, overlapping ones included."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            yield from out[node]
+
+
+class Intent:
+    def __init__(self, name, reply=None, action=None):
+        self.name = name
+        self.reply = reply
+        self.action = action
+
+
+class IntentEngine:
+    """Maps a chatbot message to the first intent (in file order) with a trigger phrase in it."""
+
+    def __init__(self, intents, task_types, fallback):
+        self.intents = intents
+        self.task_types = task_types
+        self.fallback = fallback
+        self._matcher = KeywordMatcher(
+            (trigger, priority) for priority, (intent, triggers) in enumerate(intents) for trigger in triggers
+        )
+
+    @classmethod
+    def from_file(cls, path=INTENTS_PATH):
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        intents = [
+            (Intent(item['name'], item.get('reply'), item.get('action')), item['triggers'])
+            for item in spec['intents']
+        ]
+        return cls(intents, spec['task_types'], spec['fallback'])
+
+    def match(self, message):
+        """Return the matching Intent, or None."""
+        best = min(self._matcher.iter_matches(message), default=None)
+        return self.intents[best][0] if best is not None else None
+
+
+intent_engine = IntentEngine.from_file()
@@ -0,0 +1,368 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, abort, current_app, jsonify, request, send_file, stream_with_context, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import and_, delete, func, or_, update
+from werkzeug.datastructures import MultiDict
+from models import db, BudgetRollup, Job
+from exports import EXPORT_FORMATS, available_formats, iter_csv, progress_csv
+from reports import iter_report_batches, report_filters
+from workers import BackgroundWorker
+
+FINISHED = ('done', 'failed')
+
+
+# Job kinds. parse(data) turns the submitted JSON into the params stored on
+# the job, raising ValueError for bad input; run(user_id, params, f) writes
+# the artifact to the binary file f and returns (download name, mimetype).
+
+_REPORT_ARGS = ('status', 'from', 'to', 'group', 'totals')
+
+
+def _parse_progress_export(data):
+    fmt = data.get('format', 'csv')
+    if fmt != 'csv' and fmt not in available_formats():
+        raise ValueError(f'Unsupported format: {fmt}')
+    args = {name: data[name] for name in _REPORT_ARGS if data.get(name)}
+    if isinstance(args.get('status'), str):
+        args['status'] = [args['status']]
+    # JSON can carry any type; the query-string parsing in report_filters expects strings
+    if 'status' in args and not (isinstance(args['status'], list) and all(isinstance(s, str) for s in args['status'])):
+        raise ValueError('status must be a string or a list of strings')
+    for name in ('from', 'to', 'group'):
+        if name in args and not isinstance(args[name], str):
+            raise ValueError(f'{name} must be a string')
+    report_filters(MultiDict(args))  # Same validation as /progress.csv; InvalidFilter is a ValueError
+    return {'format': fmt, 'args': args}
+
+
+def _run_progress_export(user_id, params, f):
+    args = MultiDict(params['args'])
+    filters = report_filters(args)
+    fmt = params['format']
+    if fmt == 'csv':
+        filename, header, rows = progress_csv(user_id, args.get('group'), totals=bool(args.get('totals')), **filters)
+        for chunk in iter_csv(header, rows):
+            f.write(chunk.encode('utf-8'))
+        return filename, 'text/csv'
+    writer, mimetype, _ = EXPORT_FORMATS[fmt]
+    for chunk in writer(iter_report_batches(user_id, **filters)):
+        f.write(chunk)
+    return f'progress_report.{fmt}', mimetype
+
+
+BUDGET_HEADER = ['Year', 'Month', 'Sites', 'Project Cost', 'Execution Cost', 'Profit']
+
+
+def _parse_budget_export(data):
+    year = data.get('year')
+    if year is not None and (not isinstance(year, int) or isinstance(year, bool)):
+        raise ValueError('year must be an integer')
+    return {'year': year}
+
+
+def _run_budget_export(user_id, params, f):
+    query = BudgetRollup.query.filter(BudgetRollup.user_id == user_id, BudgetRollup.sites_count > 0)
+    if params.get('year'):
+        query = query.filter_by(year=params['year'])
+    rows = (
+        (r.year, r.month, r.sites_count, r.project_cost, r.execution_cost, r.project_cost - r.execution_cost)
+        for r in query.order_by(BudgetRollup.year, BudgetRollup.month)
+    )
+    for chunk in iter_csv(BUDGET_HEADER, rows):
+        f.write(chunk.encode('utf-8'))
+    return f'budget_{params["year"]}.csv' if params.get('year') else 'budget.csv', 'text/csv'
+
+
+# kind -> (parse, run)
+JOB_KINDS = {
+    'progress_export': (_parse_progress_export, _run_progress_export),
+    'budget_export': (_parse_budget_export, _run_budget_export),
+}
+
+
+class JobQueue(BackgroundWorker):
+    """Database-backed queue of export and report jobs, run by background threads.
+
+    Requests insert a Job row and return at once; workers claim jobs with a
+    conditional UPDATE (like the mail outbox), so several threads and
+    gunicorn processes can share the table without a broker. Each claim
+    goes to the user with the fewest running jobs, oldest job first, so
+    one user's burst cannot starve everybody else. Finished files are
+    written to JOB_STORAGE_DIR and removed after JOB_RETENTION seconds.
+    """
+
+    name = 'job-queue'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._stats_lock = threading.Lock()
+        self._stats = {'completed': 0, 'failed': 0, 'run_seconds_total': 0.0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', 2)
+        self.max_running_per_user = app.config.get('JOB_MAX_RUNNING_PER_USER', 1)
+        self.max_pending_per_user = app.config.get('JOB_MAX_PENDING_PER_USER', 10)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 5)
+        # A worker that dies mid-job leaves it 'running'; hand it to another worker after this long
+        self.claim_timeout = app.config.get('JOB_CLAIM_TIMEOUT', 1800)
+        self.retention = app.config.get('JOB_RETENTION', 86400)
+        # Seconds clients are told (Retry-After) to wait before polling an unfinished job again
+        self.retry_after = app.config.get('JOB_RETRY_AFTER', 2)
+        # /jobs/<id>/events holds a web worker per open stream, so it is only for async (gevent) servers
+        self.events = app.config.get('JOB_EVENTS', False)
+        self.storage_dir = app.config.get('JOB_STORAGE_DIR') or os.path.join(app.instance_path, 'jobs')
+        os.makedirs(self.storage_dir, exist_ok=True)
+        app.extensions['job_queue'] = self
+
+    def submit(self, user_id, kind, params):
+        job = Job(user_id=user_id, kind=kind, params=json.dumps(params))
+        db.session.add(job)
+        db.session.commit()
+        self.start()
+        self.wake()
+        return job
+
+    def pending_count(self, user_id):
+        return Job.query.filter(Job.user_id == user_id, Job.status.in_(('queued', 'running'))).count()
+
+    def path(self, job):
+        return os.path.join(self.storage_dir, job.artifact)
+
+    def work(self):
+        processed = self.process_next()
+        if not processed:
+            self.purge_expired()
+        return processed
+
+    def _ready(self, now):
+        return or_(
+            Job.status == 'queued',
+            and_(Job.status == 'running', Job.claimed_at < now - timedelta(seconds=self.claim_timeout)),
+        )
+
+    def _claim(self):
+        now = datetime.utcnow()
+        running = dict(
+            db.session.query(Job.user_id, func.count(Job.id))
+            .filter(Job.status == 'running', Job.claimed_at >= now - timedelta(seconds=self.claim_timeout))
+            .group_by(Job.user_id)
+        )
+        # Each user's oldest ready job; least busy user first, then first come first served
+        candidates = db.session.query(func.min(Job.id), Job.user_id).filter(self._ready(now)).group_by(Job.user_id).all()
+        for job_id, user_id in sorted(candidates, key=lambda c: (running.get(c[1], 0), c[0])):
+            if running.get(user_id, 0) >= self.max_running_per_user:
+                continue
+            token = uuid.uuid4().hex
+            result = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, self._ready(now))
+                .values(status='running', claim_token=token, claimed_at=now)
+            )
+            db.session.commit()
+            if result.rowcount:
+                return Job.query.filter_by(id=job_id, claim_token=token).first()
+        return None
+
+    def process_next(self):
+        """Claim and run one job; returns how many were run (0 or 1)."""
+        job = self._claim()
+        if job is None:
+            return 0
+        job_id, token, user_id, kind = job.id, job.claim_token, job.user_id, job.kind
+        _, run = JOB_KINDS[kind]
+        params = json.loads(job.params)
+        artifact = f'{job_id}-{token}'
+        path = os.path.join(self.storage_dir, artifact)
+        started = time.perf_counter()
+        try:
+            # Written under a temporary name, so a download never sees a half-written file
+            with open(path + '.part', 'wb') as f:
+                filename, mimetype = run(user_id, params, f)
+            os.replace(path + '.part', path)
+            values = {'status': 'done', 'artifact': artifact, 'filename': filename,
+                      'mimetype': mimetype, 'size': os.path.getsize(path)}
+        except Exception as exc:
+            db.session.rollback()
+            self.app.logger.exception('Job %s (%s) failed', job_id, kind)
+            _remove(path + '.part')
+            path = None
+            values = {'status': 'failed', 'error': str(exc)[:1000]}
+        # Conditional on our claim: a job reclaimed after JOB_CLAIM_TIMEOUT belongs to the newer worker
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.claim_token == token)
+            .values(finished_at=datetime.utcnow(), **values)
+        )
+        db.session.commit()
+        if not result.rowcount and path:
+            _remove(path)
+        with self._stats_lock:
+            self._stats['completed' if values['status'] == 'done' else 'failed'] += 1
+            self._stats['run_seconds_total'] += time.perf_counter() - started
+        return 1
+
+    def purge_expired(self):
+        """Delete finished jobs older than JOB_RETENTION, with their files."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        expired = Job.query.filter(Job.status.in_(FINISHED), Job.finished_at < cutoff).limit(100).all()
+        if not expired:
+            return 0
+        for job in expired:
+            if job.artifact:
+                _remove(self.path(job))
+        db.session.execute(delete(Job).where(Job.id.in_([job.id for job in expired])))
+        db.session.commit()
+        return len(expired)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+job_queue = JobQueue()
+
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+def _job_json(job):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'error': job.error,
+        'filename': job.filename,
+        'size': job.size,
+        'created_at': job.created_at.isoformat() if job.created_at else '',
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'url': url_for('jobs.job_status', job_id=job.id),
+    }
+    if job_queue.events:
+        data['events_url'] = url_for('jobs.job_events', job_id=job.id)
+    if job.status == 'done':
+        data['download_url'] = url_for('jobs.download_job', job_id=job.id)
+    return data
+
+
+def _user_job(job_id):
+    return Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+
+
+def _job_response(job, status=200):
+    response = jsonify(_job_json(job))
+    response.status_code = status
+    if job.status not in FINISHED:
+        response.headers['Retry-After'] = str(job_queue.retry_after)
+    return response
+
+
+@jobs_bp.route('/jobs', methods=['POST'])
+@login_required
+def submit_job():
+    # {"kind": "progress_export", "format": "xlsx", "status": ["Active"], "from": "2024-01-01"} or {"kind": "budget_export", "year": 2024}
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'status': 'error', 'message': 'No data provided'}), 400
+    if data.get('kind') not in JOB_KINDS:
+        return jsonify({'status': 'error', 'message': 'kind must be one of ' + ', '.join(JOB_KINDS)}), 400
+    parse, _ = JOB_KINDS[data['kind']]
+    try:
+        params = parse(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if job_queue.pending_count(current_user.id) >= job_queue.max_pending_per_user:
+        response = jsonify({'status': 'error', 'message': 'Too many jobs in progress, please wait for one to finish'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(job_queue.poll_interval)
+        return response
+    job = job_queue.submit(current_user.id, data['kind'], params)
+    # Poll the Location until the job is done or failed, waiting Retry-After seconds between polls
+    response = _job_response(job, 202)
+    response.headers['Location'] = url_for('jobs.job_status', job_id=job.id)
+    return response
+
+
+@jobs_bp.route('/jobs')
+@login_required
+def list_jobs():
+    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.id.desc()).limit(50)
+    return jsonify({'jobs': [_job_json(job) for job in jobs]})
+
+
+@jobs_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    return _job_response(_user_job(job_id))
+
+
+@jobs_bp.route('/jobs/<int:job_id>/events')
+@login_required
+def job_events(job_id):
+    # Server-sent events: the job as JSON whenever it changes, until it finishes or JOB_EVENTS_TIMEOUT passes
+    # (EventSource then reconnects). Holds a web worker while open, so it is off unless JOB_EVENTS is set;
+    # on sync gunicorn workers poll /jobs/<id> instead.
+    if not job_queue.events:
+        abort(404)
+    _user_job(job_id)
+    interval = current_app.config.get('JOB_EVENTS_INTERVAL', 1)
+    deadline = time.monotonic() + current_app.config.get('JOB_EVENTS_TIMEOUT', 300)
+
+    def stream():
+        last = None
+        while True:
+            job = db.session.get(Job, job_id, populate_existing=True)
+            snapshot = _job_json(job)
+            # End the transaction, so the next read sees the workers' commits (SQLite reads from a snapshot)
+            db.session.rollback()
+            if snapshot != last:
+                yield f'data: {json.dumps(snapshot)}\n\n'
+                last = snapshot
+            if snapshot['status'] in FINISHED or time.monotonic() >= deadline:
+                return
+            time.sleep(interval)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers=headers)
+
+
+@jobs_bp.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job(job_id):
+    job = _user_job(job_id)
+    if job.status != 'done':
+        return jsonify({'status': 'error', 'message': f'Job is {job.status}'}), 409
+    response = send_file(job_queue.path(job), mimetype=job.mimetype, as_attachment=True, download_name=job.filename)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@jobs_bp.route('/jobs/<int:job_id>', methods=['DELETE'])
+@login_required
+def delete_job(job_id):
+    job = _user_job(job_id)
+    artifact = job.artifact
+    # Conditional, so a job a worker has just claimed is not deleted under it
+    result = db.session.execute(
+        delete(Job).where(Job.id == job.id, Job.status.in_(('queued',) + FINISHED))
+    )
+    db.session.commit()
+    if not result.rowcount:
+        return jsonify({'status': 'error', 'message': 'Job is running'}), 409
+    if artifact:
+        _remove(os.path.join(job_queue.storage_dir, artifact))
+    return jsonify({'status': 'deleted'})
@@ -0,0 +1,109 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, or_, update
+from models import db, OutboxMessage
+from smtp_pool import SMTPConnectionPool, is_connection_error
+from workers import BackgroundWorker
+
+
+class MailQueue(BackgroundWorker):
+    """Persistent outbox for email, delivered by a pool of background threads.
+
+    Requests only insert an OutboxMessage row; workers claim due rows in
+    batches, send them over pooled SMTP connections and reschedule
+    failures with exponential backoff. Claims go through a conditional
+    UPDATE, so several workers (and gunicorn processes) can share the table.
+    """
+
+    name = 'mail-queue'
+
+    def __init__(self, app=None):
+        super().__init__()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('MAIL_QUEUE_WORKERS', 2)
+        self.batch_size = app.config.get('MAIL_QUEUE_BATCH_SIZE', 20)
+        self.max_attempts = app.config.get('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('MAIL_QUEUE_BACKOFF', 30)
+        self.poll_interval = app.config.get('MAIL_QUEUE_POLL_INTERVAL', 5)
+        # A worker that dies mid-send leaves rows 'sending'; reclaim them after this long
+        self.claim_timeout = app.config.get('MAIL_QUEUE_CLAIM_TIMEOUT', 600)
+        # Shared by all worker threads, so SMTP sessions outlive a single batch
+        self.pool = SMTPConnectionPool.from_config(app.config)
+        app.extensions['mail_queue'] = self
+
+    def enqueue(self, subject, recipients, body, sender=None):
+        message = OutboxMessage(subject=subject, recipients=json.dumps(list(recipients)), body=body, sender=sender)
+        db.session.add(message)
+        db.session.commit()
+        self.start()
+        self.wake()
+        return message
+
+    def work(self):
+        return self.process_pending()
+
+    def _ready(self, now):
+        return or_(
+            and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+            and_(OutboxMessage.status == 'sending', OutboxMessage.claimed_at < now - timedelta(seconds=self.claim_timeout)),
+        )
+
+    def _claim(self):
+        now = datetime.utcnow()
+        ids = [i for (i,) in db.session.query(OutboxMessage.id).filter(self._ready(now)).order_by(OutboxMessage.id).limit(self.batch_size)]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(ids), self._ready(now))
+            .values(status='sending', claim_token=token, claimed_at=now)
+        )
+        db.session.commit()
+        return OutboxMessage.query.filter_by(claim_token=token, status='sending').order_by(OutboxMessage.id).all()
+
+    def _failed(self, message, error):
+        message.attempts += 1
+        message.last_error = str(error)[:1000]
+        if message.attempts >= self.max_attempts:
+            message.status = 'failed'
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.backoff * 2 ** (message.attempts - 1))
+
+    def process_pending(self):
+        """Claim and deliver one batch of due messages; returns how many were claimed."""
+        messages = self._claim()
+        if not messages:
+            return 0
+        suppress = current_app.extensions['mail'].suppress
+        for i, message in enumerate(messages):
+            try:
+                if not suppress:
+                    self.pool.send_message(Message(message.subject, recipients=json.loads(message.recipients),
+                                                   body=message.body, sender=message.sender))
+            except Exception as exc:
+                if not is_connection_error(exc):
+                    self._failed(message, exc)
+                    continue
+                # Server unreachable: reschedule the rest of the batch rather than reconnecting per message
+                current_app.logger.warning('Mail delivery failed: %s', exc)
+                for pending in messages[i:]:
+                    self._failed(pending, exc)
+                break
+            else:
+                message.status = 'sent'
+                message.attempts += 1
+                message.sent_at = datetime.utcnow()
+        db.session.commit()
+        return len(messages)
+
+
+mail_queue = MailQueue()
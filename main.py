@@ -1,5 +1,7 @@
 from flask import Flask, render_template, request
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import click
 from datetime import timedelta
 from flask_login import LoginManager, current_user
 from flask_mail import Mail
@@ -7,7 +9,21 @@ from models import db, User
 from auth import auth_bp
 from tasks import tasks_bp
 from chatbot import chatbot_bp  # If you modularize chatbot
+from stats import task_status_summary
+from search import init_search
+import rollup
+from cache import visitor_cache
+from mailer import mail_queue
+from jobs import job_queue, jobs_bp
+from identity import identity_cache
+from conversations import conversations
+from metrics import metrics
+from passwords import password_hasher
+from throttle import login_throttle
 from sqlalchemy import text, inspect
+import db_config
+from conditional import template_version
+from replica import read_replica
 
 # Load environment variables from .env file if it exists
 try:
@@ -17,30 +33,96 @@ except ImportError:
     pass  # python-dotenv not installed, continue without it
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SUPABASE_DATABASE_URL', 'sqlite:///tasks.db')
+db_config.configure_app(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
-app.config['MAIL_SERVER'] = 'smtp.sendgrid.net'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['TASKS_PAGE_SIZE'] = int(os.environ.get('TASKS_PAGE_SIZE', 50))
+app.config['TASKS_PAGE_SIZE_MAX'] = int(os.environ.get('TASKS_PAGE_SIZE_MAX', 200))
+app.config['SEARCH_RESULT_LIMIT'] = int(os.environ.get('SEARCH_RESULT_LIMIT', 50))
+app.config['SEARCH_RESULT_LIMIT_MAX'] = int(os.environ.get('SEARCH_RESULT_LIMIT_MAX', 200))
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+app.config['EXPORT_GZIP'] = os.environ.get('EXPORT_GZIP', '1') != '0'
+app.config['EXPORT_ROW_GROUP_SIZE'] = int(os.environ.get('EXPORT_ROW_GROUP_SIZE', 65536))
+app.config['EXPORT_PARQUET_COMPRESSION'] = os.environ.get('EXPORT_PARQUET_COMPRESSION', 'zstd')
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+app.config['IMPORT_MAX_ERRORS'] = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+app.config['BATCH_MAX_IDS'] = int(os.environ.get('BATCH_MAX_IDS', 1000))
+app.config['VISITOR_CACHE_URL'] = os.environ.get('VISITOR_CACHE_URL', 'memory://')
+app.config['VISITOR_CACHE_TTL'] = int(os.environ.get('VISITOR_CACHE_TTL', 60))
+app.config['VISITOR_CACHE_SIZE'] = int(os.environ.get('VISITOR_CACHE_SIZE', 512))
+app.config['IDENTITY_CACHE_URL'] = os.environ.get('IDENTITY_CACHE_URL', app.config['VISITOR_CACHE_URL'])
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+app.config['LOGIN_RATE_WINDOW'] = int(os.environ.get('LOGIN_RATE_WINDOW', 60))
+app.config['LOGIN_RATE_PER_IP'] = int(os.environ.get('LOGIN_RATE_PER_IP', 20))
+app.config['LOGIN_RATE_PER_EMAIL'] = int(os.environ.get('LOGIN_RATE_PER_EMAIL', 10))
+app.config['LOGIN_RATE_CACHE_URL'] = os.environ.get('LOGIN_RATE_CACHE_URL', app.config['VISITOR_CACHE_URL'])
+# Reverse proxies in front of the app; their X-Forwarded-For/-Proto give the client address the login limits key on
+app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', 0))
+# Part of every ETag and visitor-cache key; defaults to a digest of the templates so a deploy that changes pages invalidates 304s
+app.config['APP_VERSION'] = os.environ.get('APP_VERSION') or template_version(app)
+app.config['CHATBOT_STATE_URL'] = os.environ.get('CHATBOT_STATE_URL', 'db://')
+app.config['CHATBOT_STATE_TTL'] = int(os.environ.get('CHATBOT_STATE_TTL', 900))
+app.config['CHATBOT_STATE_SIZE'] = int(os.environ.get('CHATBOT_STATE_SIZE', 1024))
+app.config['CHATBOT_BATCH_MAX'] = int(os.environ.get('CHATBOT_BATCH_MAX', 100))
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 0))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Override MAIL_SERVER/MAIL_PORT/MAIL_USE_TLS to point at a local SMTP stand-in during development
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.sendgrid.net')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') != '0'
 app.config['MAIL_USERNAME'] = 'apikey'
 app.config['MAIL_PASSWORD'] = os.environ.get('SENDGRID_API_KEY')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
+app.config['MAIL_QUEUE_WORKERS'] = int(os.environ.get('MAIL_QUEUE_WORKERS', 2))
+app.config['MAIL_QUEUE_BATCH_SIZE'] = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE', 20))
+app.config['MAIL_QUEUE_MAX_ATTEMPTS'] = int(os.environ.get('MAIL_QUEUE_MAX_ATTEMPTS', 5))
+app.config['MAIL_QUEUE_BACKOFF'] = int(os.environ.get('MAIL_QUEUE_BACKOFF', 30))
+app.config['MAIL_POOL_SIZE'] = int(os.environ.get('MAIL_POOL_SIZE', 4))
+app.config['MAIL_POOL_MAX_IDLE'] = int(os.environ.get('MAIL_POOL_MAX_IDLE', 60))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_RUNNING_PER_USER'] = int(os.environ.get('JOB_MAX_RUNNING_PER_USER', 1))
+app.config['JOB_MAX_PENDING_PER_USER'] = int(os.environ.get('JOB_MAX_PENDING_PER_USER', 10))
+app.config['JOB_STORAGE_DIR'] = os.environ.get('JOB_STORAGE_DIR')
+app.config['JOB_RETENTION'] = int(os.environ.get('JOB_RETENTION', 86400))
+app.config['JOB_EVENTS'] = os.environ.get('JOB_EVENTS', '0') == '1'
+
+if app.config['PROXY_FIX_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
 
 db.init_app(app)
 mail = Mail(app)
+mail_queue.init_app(app)
+job_queue.init_app(app)
+visitor_cache.init_app(app)
+identity_cache.init_app(app)
+password_hasher.init_app(app)
+login_throttle.init_app(app)
+conversations.init_app(app)
+metrics.init_app(app)
+metrics.register_stats('mail_pool', mail_queue.pool.stats)
+metrics.register_stats('password_hash', password_hasher.stats)
+metrics.register_stats('chatbot_conversations', conversations.stats)
+metrics.register_stats('jobs', job_queue.stats)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # Served from the identity cache; the User row is only read on a miss
+    return identity_cache.load(int(user_id))
 
 with app.app_context():
+    # Before the first connection is opened, so the connect hooks see every pooled connection
+    for engine in db.engines.values():
+        db_config.register_engine_events(engine)
     db.create_all()
-    # Lightweight migration to add cost columns if missing
+    # Lightweight migration to add new columns if missing
     try:
         inspector = inspect(db.engine)
         columns = {col['name'] for col in inspector.get_columns('task')}
@@ -48,68 +130,120 @@ with app.app_context():
             db.session.execute(text('ALTER TABLE task ADD COLUMN project_cost INTEGER NOT NULL DEFAULT 0'))
         if 'execution_cost' not in columns:
             db.session.execute(text('ALTER TABLE task ADD COLUMN execution_cost INTEGER NOT NULL DEFAULT 0'))
+        if 'updated_at' not in columns:
+            db.session.execute(text('ALTER TABLE task ADD COLUMN updated_at TIMESTAMP'))
+            db.session.execute(text('UPDATE task SET updated_at = created_at'))
+        if 'version' not in columns:
+            db.session.execute(text('ALTER TABLE task ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        user_columns = {col['name'] for col in inspector.get_columns('user')}
+        if 'data_version' not in user_columns:
+            db.session.execute(text('ALTER TABLE "user" ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0'))
         db.session.commit()
     except Exception:
         db.session.rollback()
+        app.logger.exception('Could not add missing columns; the schema may be out of date')
+    # create_all() skips indexes on tables that already exist, so add any missing ones
+    from models import Task
+    for index in Task.__table__.indexes:
+        try:
+            index.create(db.engine, checkfirst=True)
+        except Exception:
+            app.logger.exception('Could not create index %s', index.name)
+    init_search(db.engine)
+    rollup.ensure_backfilled()
+    # Deliver anything left in the outbox by a previous run
+    mail_queue.start()
+    # Pick up jobs queued (or left running) by a previous run
+    job_queue.start()
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(tasks_bp)
 app.register_blueprint(chatbot_bp)  # If you modularize chatbot
+app.register_blueprint(jobs_bp)
+
+@app.cli.command('rebuild-budget-rollup')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user\'s rows.')
+def rebuild_budget_rollup(user_id):
+    """Recompute the monthly budget rollup from the task table."""
+    rollup.rebuild(user_id)
+    click.echo('Budget rollup rebuilt.')
+
+@app.cli.command('check-budget-rollup')
+@click.option('--user-id', type=int, default=None, help='Only check this user\'s rows.')
+@click.option('--fix', is_flag=True, help='Rebuild the rollup if it has drifted.')
+def check_budget_rollup(user_id, fix):
+    """Verify the monthly budget rollup against the task table; exits 1 on drift."""
+    drift = rollup.verify(user_id)
+    for (owner, year, month), stored, expected in drift:
+        click.echo(f'user {owner} {year}-{month:02d}: stored {stored}, expected {expected}')
+    if not drift:
+        click.echo('Budget rollup is consistent.')
+        return
+    if fix:
+        rollup.rebuild(user_id)
+        click.echo('Budget rollup rebuilt.')
+        return
+    raise SystemExit(1)
+
+@app.cli.command('send-queued-mail')
+def send_queued_mail():
+    """Deliver due outbox messages in the foreground (e.g. with MAIL_QUEUE_WORKERS=0)."""
+    sent = 0
+    while True:
+        processed = mail_queue.process_pending()
+        if not processed:
+            break
+        sent += processed
+    click.echo(f'Processed {sent} queued message(s).')
+
+@app.cli.command('run-jobs')
+def run_jobs():
+    """Run queued export/report jobs in the foreground (e.g. with JOB_WORKERS=0)."""
+    ran = 0
+    while job_queue.process_next():
+        ran += 1
+    job_queue.purge_expired()
+    click.echo(f'Ran {ran} job(s).')
 
 @app.route('/')
 def home():
     user_count = User.query.count()
     if current_user.is_authenticated:
-        from models import Task
-        total_tasks = Task.query.filter_by(user_id=current_user.id).count()
-        active_count = Task.query.filter_by(user_id=current_user.id, status='Active').count()
-        onhold_count = Task.query.filter_by(user_id=current_user.id, status='On hold').count()
-        closed_count = Task.query.filter_by(user_id=current_user.id, status='Closed').count()
+        counts = task_status_summary(current_user.id)
     else:
-        total_tasks = active_count = onhold_count = closed_count = None
-    return render_template('home.html', total_tasks=total_tasks, active_count=active_count, onhold_count=onhold_count, closed_count=closed_count, user_count=user_count)
+        counts = dict.fromkeys(('total_tasks', 'active_count', 'onhold_count', 'closed_count'))
+    return render_template('home.html', user_count=user_count, **counts)
 
 @app.route('/about')
 def about():
     return render_template('about.html')
 
 @app.route('/budget')
+@read_replica
 def budget_dashboard():
-    from models import Task
-    from sqlalchemy import func, extract
+    from models import BudgetRollup
     from datetime import datetime
     
     # Get year filter from query parameters
     year_filter = request.args.get('year', datetime.now().year, type=int)
     
-    # Base query for user's tasks
-    base_query = Task.query.filter_by(user_id=current_user.id)
-    
-    # Apply year filter
+    # Monthly rollup rows for the user (at most 12 per year)
+    rollup_query = BudgetRollup.query.filter_by(user_id=current_user.id)
     if year_filter:
-        year_query = base_query.filter(extract('year', Task.created_at) == year_filter)
-    else:
-        year_query = base_query
+        rollup_query = rollup_query.filter_by(year=year_filter)
+    rollup_rows = rollup_query.all()
     
     # Calculate budget metrics
-    total_sites = year_query.count()
-    total_project_cost = year_query.with_entities(func.sum(Task.project_cost)).scalar() or 0
-    total_execution_cost = year_query.with_entities(func.sum(Task.execution_cost)).scalar() or 0
+    total_sites = sum(r.sites_count for r in rollup_rows)
+    total_project_cost = sum(r.project_cost for r in rollup_rows)
+    total_execution_cost = sum(r.execution_cost for r in rollup_rows)
     total_profit = total_project_cost - total_execution_cost
     profit_percentage = (total_profit / total_project_cost * 100) if total_project_cost > 0 else 0
     
-    # Get monthly data for charts
-    monthly_data = year_query.with_entities(
-        extract('month', Task.created_at).label('month'),
-        func.count(Task.id).label('sites_count'),
-        func.sum(Task.project_cost).label('project_cost'),
-        func.sum(Task.execution_cost).label('execution_cost')
-    ).group_by(extract('month', Task.created_at)).all()
-    
     # Get available years for filter dropdown
-    available_years = base_query.with_entities(
-        extract('year', Task.created_at).label('year')
-    ).distinct().order_by(extract('year', Task.created_at).desc()).all()
+    available_years = BudgetRollup.query.with_entities(BudgetRollup.year).filter(
+        BudgetRollup.user_id == current_user.id, BudgetRollup.sites_count > 0
+    ).distinct().order_by(BudgetRollup.year.desc()).all()
     
     # Format monthly data for charts
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
@@ -123,12 +257,12 @@ def budget_dashboard():
         'profits': [0] * 12
     }
     
-    for data in monthly_data:
-        month_idx = int(data.month) - 1
-        chart_data['sites'][month_idx] = data.sites_count or 0
-        chart_data['project_costs'][month_idx] = data.project_cost or 0
-        chart_data['execution_costs'][month_idx] = data.execution_cost or 0
-        chart_data['profits'][month_idx] = (data.project_cost or 0) - (data.execution_cost or 0)
+    for data in rollup_rows:
+        month_idx = data.month - 1
+        chart_data['sites'][month_idx] += data.sites_count
+        chart_data['project_costs'][month_idx] += data.project_cost
+        chart_data['execution_costs'][month_idx] += data.execution_cost
+        chart_data['profits'][month_idx] += data.project_cost - data.execution_cost
     
     return render_template('budget_dashboard.html',
                          total_sites=total_sites,
@@ -0,0 +1,214 @@
+import threading
+import time
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets, per metric
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class Metrics:
+    """Per-endpoint request metrics in Prometheus text format.
+
+    Records latency, response size, SQL query count and time (from engine
+    cursor events) and template render time for every request, and
+    optionally logs requests slower than ``SLOW_REQUEST_MS``. Streamed
+    responses are recorded when the server closes them, so their figures
+    cover the whole body, including the queries run while it is sent.
+    Figures are per process; Prometheus sums them across gunicorn workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}  # (endpoint, method, status) -> count
+        self._latency = {}
+        self._sizes = {}
+        self._queries = {}
+        self._sql_seconds = {}
+        self._template_seconds = {}
+        self._stats = []  # (name, callable returning a stats dict)
+        self.slow_request_ms = 0
+        self.token = None
+        self.logger = None
+
+    def init_app(self, app):
+        self.logger = app.logger
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_MS', 0)
+        self.token = app.config.get('METRICS_TOKEN')
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['metrics'] = self
+
+    def register_stats(self, name, stats):
+        """Export the numbers in ``stats()`` (e.g. SMTPConnectionPool.stats) as junate_<name>_<key> gauges."""
+        self._stats.append((name, stats))
+
+    # Request lifecycle
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_template_seconds = 0.0
+
+    def _template_started(self, sender, template, context, **extra):
+        g.metrics_template_started = time.perf_counter()
+
+    def _template_finished(self, sender, template, context, **extra):
+        if 'metrics_template_started' in g:
+            g.metrics_template_seconds += time.perf_counter() - g.pop('metrics_template_started')
+
+    def _finish(self, response):
+        if 'metrics_started' not in g or request.endpoint == 'metrics':
+            return response
+        observation = {
+            'endpoint': request.endpoint or 'unmatched',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'started': g.metrics_started,
+            # The counters live on g, which stream_with_context keeps using while the body is sent
+            'g': g._get_current_object(),
+            'size': None,
+        }
+        if response.is_streamed:
+            observation['size'] = 0
+            response.response = self._count_bytes(response.response, observation)
+            response.call_on_close(lambda: self._record(observation))
+        else:
+            observation['size'] = response.calculate_content_length()
+            self._record(observation)
+        return response
+
+    @staticmethod
+    def _count_bytes(body, observation):
+        try:
+            for chunk in body:
+                observation['size'] += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def _record(self, observation):
+        seconds = time.perf_counter() - observation['started']
+        endpoint, size, request_g = observation['endpoint'], observation['size'], observation['g']
+        with self._lock:
+            key = (endpoint, observation['method'], observation['status'])
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._queries.setdefault(endpoint, Histogram(QUERY_COUNT_BUCKETS)).observe(request_g.metrics_queries)
+            self._sql_seconds[endpoint] = self._sql_seconds.get(endpoint, 0.0) + request_g.metrics_sql_seconds
+            self._template_seconds[endpoint] = self._template_seconds.get(endpoint, 0.0) + request_g.metrics_template_seconds
+            if size is not None:
+                self._sizes.setdefault(endpoint, Histogram(SIZE_BUCKETS)).observe(size)
+        if self.slow_request_ms and seconds * 1000 >= self.slow_request_ms:
+            self.logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, templates %.1f ms',
+                observation['method'], observation['path'], endpoint, seconds * 1000,
+                request_g.metrics_queries, request_g.metrics_sql_seconds * 1000, request_g.metrics_template_seconds * 1000,
+            )
+
+    # Exposition
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE junate_http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'junate_http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+            for name, histograms in (
+                ('junate_http_request_duration_seconds', self._latency),
+                ('junate_http_response_size_bytes', self._sizes),
+                ('junate_db_queries_per_request', self._queries),
+            ):
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{_labels(endpoint=endpoint, le=_format_bound(bound))}}} {count}')
+                        total = count
+                    lines.append(f'{name}_sum{{{_labels(endpoint=endpoint)}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{_labels(endpoint=endpoint)}}} {total}')
+            for name, sums in (
+                ('junate_db_query_seconds_total', self._sql_seconds),
+                ('junate_template_render_seconds_total', self._template_seconds),
+            ):
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, value in sorted(sums.items()):
+                    lines.append(f'{name}{{{_labels(endpoint=endpoint)}}} {value}')
+        for prefix, stats in self._stats:
+            values = stats()
+            for key, value in sorted(values.items()):
+                name = f'junate_{prefix}_{key}'
+                if isinstance(value, dict):
+                    # Cumulative {upper bound: count} histogram; '<name>_total' in the same stats is its sum
+                    base = key.removesuffix('_histogram')
+                    name = f'junate_{prefix}_{base}'
+                    lines.append(f'# TYPE {name} histogram')
+                    count = 0
+                    for bound, count in value.items():
+                        lines.append(f'{name}_bucket{{{_labels(le=_format_bound(bound))}}} {count}')
+                    if f'{base}_total' in values:
+                        lines.append(f'{name}_sum {values[f"{base}_total"]}')
+                    lines.append(f'{name}_count {count}')
+                elif isinstance(value, (int, float)):
+                    lines.append(f'# TYPE {name} gauge')
+                    lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        if self.token and request.headers.get('Authorization') != f'Bearer {self.token}':
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_query_started', None)
+    # Background workers (mail queue) have no request to charge the query to
+    if started is not None and has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_sql_seconds += time.perf_counter() - started
@@ -1,23 +1,45 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from replica import RoutingSession
+from passwords import password_hasher
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+TASK_STATUSES = ('Active', 'On hold', 'Closed')
+# Lower-case spelling -> canonical status; imports and /batch/status match statuses case-insensitively
+_STATUS_NAMES = {status.lower(): status for status in TASK_STATUSES}
+
+
+def canonical_status(value):
+    """``value`` in its TASK_STATUSES spelling, ignoring case; None if it is not a status."""
+    return _STATUS_NAMES.get(value.lower()) if isinstance(value, str) else None
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
+    # Bumped whenever any of the user's tasks change; read-only routes derive their ETags from it
+    data_version = db.Column(db.Integer, default=0, nullable=False)
 
+    # Hashing runs on password_hasher's bounded pool; both may raise passwords.HashingBusy
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
 class Task(db.Model):
+    # Every listing is scoped to user_id; status counts and the budget year range ride on these
+    __table_args__ = (
+        db.Index('ix_task_user_status', 'user_id', 'status'),
+        db.Index('ix_task_user_created_at', 'user_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     task = db.Column(db.String(200), nullable=False)
     owner = db.Column(db.String(100), nullable=False)
@@ -29,5 +51,67 @@ class Task(db.Model):
     status = db.Column(db.String(20), default='Active', nullable=False)
     project_cost = db.Column(db.Integer, default=0, nullable=False)
     execution_cost = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    version = db.Column(db.Integer, default=1, onupdate=db.text('version + 1'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    user = db.relationship('User', backref=db.backref('tasks', lazy=True))
\ No newline at end of file
+    user = db.relationship('User', backref=db.backref('tasks', lazy=True))
+
+class BudgetRollup(db.Model):
+    # Per-user monthly totals over Task, maintained by rollup.py
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    sites_count = db.Column(db.Integer, default=0, nullable=False)
+    project_cost = db.Column(db.BigInteger, default=0, nullable=False)
+    execution_cost = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class OutboxMessage(db.Model):
+    # Outgoing email waiting for (or done with) delivery by mailer.py
+    __table_args__ = (
+        db.Index('ix_outbox_message_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # JSON list
+    sender = db.Column(db.String(255), nullable=True)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claim_token = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+
+class Job(db.Model):
+    # Background export/report run by jobs.py; the finished file lives under JOB_STORAGE_DIR
+    __table_args__ = (
+        db.Index('ix_job_status_user_id', 'status', 'user_id'),
+        db.Index('ix_job_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(40), nullable=False)
+    params = db.Column(db.Text, nullable=False)  # JSON object
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed
+    error = db.Column(db.Text, nullable=True)
+    artifact = db.Column(db.String(255), nullable=True)  # file name in JOB_STORAGE_DIR
+    filename = db.Column(db.String(255), nullable=True)  # download name
+    mimetype = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claim_token = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class ChatbotConversation(db.Model):
+    # Step-by-step chatbot state kept by conversations.py, one row per user and browser session
+    key = db.Column(db.String(100), primary_key=True)
+    state = db.Column(db.Text, nullable=False)  # JSON object
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,73 @@
+import base64
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_
+from models import Task
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(task):
+    raw = f'{task.created_at.isoformat()}|{task.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, task_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(task_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor('Invalid cursor') from exc
+
+
+def page_size():
+    # ?limit= may shrink or grow the page up to TASKS_PAGE_SIZE_MAX
+    default = current_app.config.get('TASKS_PAGE_SIZE', 50)
+    maximum = current_app.config.get('TASKS_PAGE_SIZE_MAX', 200)
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+
+def _seek(query, cursor):
+    if cursor:
+        created_at, task_id = decode_cursor(cursor)
+        query = query.filter(or_(Task.created_at > created_at,
+                                 and_(Task.created_at == created_at, Task.id > task_id)))
+    return query.order_by(Task.created_at, Task.id)
+
+
+def keyset_page(query, cursor=None, limit=50):
+    """Return (tasks, next_cursor) for the page after ``cursor``, ordered by (created_at, id).
+
+    Seeking past the last seen row keeps every page an index range scan on
+    (user_id, created_at), unlike OFFSET which re-reads all earlier rows.
+    """
+    tasks = _seek(query, cursor).limit(limit + 1).all()
+    next_cursor = encode_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    return tasks[:limit], next_cursor
+
+
+class KeysetPageStream:
+    """The same page as keyset_page(), fetched while a streamed template iterates it.
+
+    ``next_cursor`` is only known once the loop has finished, so templates
+    read it after the loop. An invalid cursor raises InvalidCursor here,
+    before any of the response has been sent.
+    """
+
+    def __init__(self, query, cursor=None, limit=50):
+        self.query = _seek(query, cursor).limit(limit + 1)
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for n, task in enumerate(self.query.yield_per(min(self.limit + 1, current_app.config.get('EXPORT_BATCH_SIZE', 1000)))):
+            if n == self.limit:
+                self.next_cursor = encode_cursor(last)
+                break
+            last = task
+            yield task
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, has_request_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from metrics import Histogram
+
+# Upper bounds (seconds) of the hash duration histogram buckets
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+class HashingBusy(Exception):
+    """Too many hash operations are already queued; the caller should retry later."""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small bounded thread pool.
+
+    hashlib's scrypt and pbkdf2 release the GIL, so at most ``workers``
+    hashes burn CPU at once while other request threads keep serving.
+    Callers beyond ``max_pending`` queued operations get HashingBusy
+    instead of piling up behind a login burst.
+    """
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.salt_length = 16
+        self.workers = 2
+        self.max_pending = 32
+        self._stored_method = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats = {
+            'operations': 0,
+            'rejected': 0,
+            'rehashed': 0,
+            'hash_seconds_total': 0.0,
+            'hash_seconds_max': 0.0,
+            'wait_seconds_total': 0.0,
+        }
+        self._hash_seconds = Histogram(HASH_BUCKETS)
+
+    def init_app(self, app):
+        # werkzeug method strings, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH', 16)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 32)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stored_method = None
+        app.after_request(self._server_timing)
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Pool threads do not survive fork, so create the executor once per process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusy()
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            return fn(*args, **kwargs), started, time.perf_counter() - started
+
+        try:
+            future = self._get_executor().submit(timed)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        result, started, seconds = future.result()
+        self._observe(seconds, started - submitted)
+        return result
+
+    def _observe(self, seconds, waited):
+        with self._lock:
+            self._stats['operations'] += 1
+            self._stats['hash_seconds_total'] += seconds
+            self._stats['hash_seconds_max'] = max(self._stats['hash_seconds_max'], seconds)
+            self._stats['wait_seconds_total'] += waited
+            self._hash_seconds.observe(seconds)
+        if has_request_context():
+            g.password_hash_seconds = g.get('password_hash_seconds', 0.0) + seconds
+            g.password_wait_seconds = g.get('password_wait_seconds', 0.0) + waited
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when ``pwhash`` was made with other parameters than the configured method."""
+        if self._stored_method is None:
+            # werkzeug fills in defaults ('scrypt' -> 'scrypt:32768:8:1'); learn the stored form once
+            self._stored_method = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._stored_method
+
+    def record_rehash(self):
+        with self._lock:
+            self._stats['rehashed'] += 1
+
+    def stats(self):
+        """Counters plus a cumulative hash duration histogram ({upper bound: count})."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hash_seconds_histogram'] = dict(self._hash_seconds.cumulative())
+        return stats
+
+    @staticmethod
+    def _server_timing(response):
+        if 'password_hash_seconds' in g:
+            response.headers.add('Server-Timing', f'hash;dur={g.password_hash_seconds * 1000:.1f}')
+            response.headers.add('Server-Timing', f'hash-wait;dur={g.password_wait_seconds * 1000:.1f}')
+        return response
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,45 @@
+import functools
+import time
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+# Flask session key: until this timestamp the browser that just wrote reads from the primary
+_PRIMARY_UNTIL = 'db_primary_until'
+# Seconds a writer keeps reading from the primary, covering typical replication lag
+STICKY_SECONDS = 10
+
+
+def _route_to_replica():
+    if not (has_app_context() and g.get('use_replica')):
+        return False
+    if has_request_context() and session.get(_PRIMARY_UNTIL, 0) > time.time():
+        return False
+    return True
+
+
+class RoutingSession(Session):
+    """Sends reads to the ``replica`` bind inside ``@read_replica`` views; everything else uses the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and REPLICA_BIND in self._db.engines
+                and not getattr(clause, 'is_dml', False) and _route_to_replica()):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Serve a read-only view from the replica, when one is configured."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(db_session):
+    # Read-your-writes: the client that just committed skips the replica until it has caught up
+    if has_request_context():
+        session[_PRIMARY_UNTIL] = time.time() + STICKY_SECONDS
@@ -0,0 +1,124 @@
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import Float, Numeric, case, cast, func, select
+from models import db, Task, TASK_STATUSES
+
+# group= values accepted by the progress report views
+REPORT_GROUPS = {'site': Task.site_name, 'status': Task.status}
+
+# REAL arithmetic on SQLite; NUMERIC on Postgres, whose round(x, n) is only defined for numeric
+_PERCENT_TYPE = Float().with_variant(Numeric(), 'postgresql')
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f'{name} must be a YYYY-MM-DD date') from None
+
+
+def report_filters(args):
+    """Filters from the query string: ?status= (repeatable) and ?from=/?to= created dates, both inclusive."""
+    filters = {}
+    statuses = [status for status in args.getlist('status') if status]
+    if statuses:
+        unknown = set(statuses) - set(TASK_STATUSES)
+        if unknown:
+            raise InvalidFilter(f'Unknown status: {", ".join(sorted(unknown))}')
+        filters['statuses'] = statuses
+    if args.get('from'):
+        filters['since'] = _parse_date(args['from'], 'from')
+    if args.get('to'):
+        filters['until'] = _parse_date(args['to'], 'to')
+    return filters
+
+
+def _where(user_id, statuses=None, since=None, until=None):
+    conditions = [Task.user_id == user_id]
+    if statuses:
+        conditions.append(Task.status.in_(statuses))
+    if since is not None:
+        conditions.append(Task.created_at >= datetime.combine(since, datetime.min.time()))
+    if until is not None:
+        conditions.append(Task.created_at < datetime.combine(until + timedelta(days=1), datetime.min.time()))
+    return conditions
+
+
+def _text(column):
+    return func.coalesce(column, '')
+
+
+def _profit_percent(project_cost, execution_cost):
+    # Share of the project cost kept as profit, to 2 places; 0 when there is no project cost
+    percent = func.round(cast(project_cost - execution_cost, _PERCENT_TYPE) * 100 / project_cost, 2)
+    return cast(case((project_cost > 0, percent), else_=0), Float)
+
+
+def report_query(user_id, **filters):
+    """Report rows for ``user_id``: only the report columns, with profit computed by the database.
+
+    ``filters`` are the keyword arguments returned by report_filters().
+    """
+    project_cost = func.coalesce(Task.project_cost, 0)
+    execution_cost = func.coalesce(Task.execution_cost, 0)
+    return (
+        select(
+            _text(Task.site_name).label('site_name'),
+            _text(Task.task).label('task'),
+            _text(Task.owner).label('owner'),
+            _text(Task.status).label('status'),
+            _text(Task.summary).label('summary'),
+            project_cost.label('project_cost'),
+            execution_cost.label('execution_cost'),
+            (project_cost - execution_cost).label('profit'),
+            _profit_percent(project_cost, execution_cost).label('profit_percent'),
+            Task.created_at.label('created_at'),
+        )
+        .where(*_where(user_id, **filters))
+        .order_by(Task.id)
+    )
+
+
+def iter_report_batches(user_id, **filters):
+    """Yield lists of report rows, EXPORT_BATCH_SIZE at a time (server-side cursor on Postgres)."""
+    stmt = report_query(user_id, **filters).execution_options(yield_per=current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+    yield from db.session.execute(stmt).partitions()
+
+
+def iter_report_rows(user_id, **filters):
+    """Yield report rows as lightweight Row tuples, streamed in batches like iter_report_batches()."""
+    for batch in iter_report_batches(user_id, **filters):
+        yield from batch
+
+
+def _aggregates():
+    project_cost = func.coalesce(func.sum(Task.project_cost), 0)
+    execution_cost = func.coalesce(func.sum(Task.execution_cost), 0)
+    return (
+        func.count(Task.id).label('tasks'),
+        project_cost.label('project_cost'),
+        execution_cost.label('execution_cost'),
+        (project_cost - execution_cost).label('profit'),
+        _profit_percent(project_cost, execution_cost).label('profit_percent'),
+    )
+
+
+def report_totals(user_id, **filters):
+    """One row of totals over all of ``user_id``'s tasks (those matching ``filters``)."""
+    return db.session.execute(select(*_aggregates()).where(*_where(user_id, **filters))).one()
+
+
+def report_rollup(user_id, group, **filters):
+    """Totals per site or per status (``group`` is a REPORT_GROUPS key), largest project cost first."""
+    column = _text(REPORT_GROUPS[group])
+    stmt = (
+        select(column.label('group'), *_aggregates())
+        .where(*_where(user_id, **filters))
+        .group_by(column)
+        .order_by(func.sum(Task.project_cost).desc(), column)
+    )
+    return db.session.execute(stmt).all()
@@ -0,0 +1,136 @@
+from collections import defaultdict
+from sqlalchemy import event, extract, func, insert, select
+from sqlalchemy.orm import Session, attributes
+from models import db, Task, BudgetRollup
+
+ROLLUP_FIELDS = ('sites_count', 'project_cost', 'execution_cost')
+
+# Task attributes that decide which rollup row a task counts towards, and with what
+TRACKED = ('user_id', 'created_at', 'project_cost', 'execution_cost')
+
+
+def contribution(user_id, created_at, project_cost, execution_cost, sign=1):
+    """One task's share of its (user_id, year, month) row; ``sign=-1`` takes it back out."""
+    return (user_id, created_at.year, created_at.month), (sign, sign * (project_cost or 0), sign * (execution_cost or 0))
+
+
+def apply_deltas(connection, deltas):
+    """Add ``contribution()`` pairs to the rollup table.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE with relative increments, so
+    concurrent writers touching the same month never lose an update.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])
+    for key, values in deltas:
+        for i, value in enumerate(values):
+            totals[key][i] += value
+    # Key order, so concurrent batches lock the rows they share in the same order instead of deadlocking
+    rows = [
+        dict(zip(('user_id', 'year', 'month') + ROLLUP_FIELDS, key + tuple(values)))
+        for key, values in sorted(totals.items()) if any(values)
+    ]
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    table = BudgetRollup.__table__
+    stmt = upsert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'year', 'month'],
+        set_={name: table.c[name] + stmt.excluded[name] for name in ROLLUP_FIELDS},
+    )
+    connection.execute(stmt, rows)
+
+
+def stored_contributions(connection, condition, sign=-1):
+    """Contributions of the task rows matching ``condition``, as currently stored in the database.
+
+    The rows are locked (FOR UPDATE on Postgres) until the transaction ends,
+    so a concurrent edit of the same task waits instead of subtracting the
+    same old values a second time. SQLite serialises writers on its own.
+    """
+    stmt = select(*(getattr(Task, name) for name in TRACKED)).where(condition).with_for_update()
+    return [contribution(*row, sign=sign) for row in connection.execute(stmt)]
+
+
+def _changed(task):
+    return any(attributes.get_history(task, name).has_changes() for name in TRACKED)
+
+
+def _current(task):
+    return contribution(task.user_id, task.created_at, task.project_cost, task.execution_cost)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_previous(session, flush_context, instances):
+    # Old values are read from the database: an expired attribute that is
+    # simply reassigned has no in-memory history to subtract
+    changed = [task for task in session.dirty if isinstance(task, Task) and _changed(task)]
+    ids = [task.id for task in changed] + [task.id for task in session.deleted if isinstance(task, Task)]
+    session.info['rollup_previous'] = stored_contributions(session.connection(), Task.id.in_(ids)) if ids else []
+    session.info['rollup_changed'] = changed
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_rollup(session, flush_context):
+    # Runs inside the flush's transaction, so the rollup commits or rolls back with the tasks
+    deltas = session.info.pop('rollup_previous', [])
+    deltas += [_current(task) for task in session.info.pop('rollup_changed', [])]
+    deltas += [_current(task) for task in session.new if isinstance(task, Task)]
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def _expected(user_id=None):
+    # The rollup rows recomputed from Task, as (user_id, year, month) + ROLLUP_FIELDS
+    year = extract('year', Task.created_at)
+    month = extract('month', Task.created_at)
+    source = select(
+        Task.user_id, year, month,
+        func.count(Task.id),
+        func.coalesce(func.sum(Task.project_cost), 0),
+        func.coalesce(func.sum(Task.execution_cost), 0),
+    )
+    if user_id is not None:
+        source = source.where(Task.user_id == user_id)
+    return source.group_by(Task.user_id, year, month)
+
+
+def rebuild(user_id=None):
+    """Recompute rollup rows from Task for one user, or for everyone when ``user_id`` is None."""
+    delete = BudgetRollup.__table__.delete()
+    if user_id is not None:
+        delete = delete.where(BudgetRollup.user_id == user_id)
+    source = _expected(user_id)
+    db.session.execute(delete)
+    db.session.execute(insert(BudgetRollup).from_select(('user_id', 'year', 'month') + ROLLUP_FIELDS, source))
+    db.session.commit()
+
+
+def verify(user_id=None):
+    """Compare the rollup with what rebuild() would write.
+
+    Returns a list of ``(key, stored, expected)`` for every (user_id, year,
+    month) that differs; all-zero rows left behind by deletions count as
+    absent. Empty when the write paths have kept the rollup exact.
+    """
+    expected = {tuple(row[:3]): tuple(row[3:]) for row in db.session.execute(_expected(user_id))}
+    stored_query = select(BudgetRollup.user_id, BudgetRollup.year, BudgetRollup.month,
+                          *(getattr(BudgetRollup, name) for name in ROLLUP_FIELDS))
+    if user_id is not None:
+        stored_query = stored_query.where(BudgetRollup.user_id == user_id)
+    stored = {tuple(row[:3]): tuple(row[3:]) for row in db.session.execute(stored_query) if any(row[3:])}
+    zero = (0,) * len(ROLLUP_FIELDS)
+    return [
+        (key, stored.get(key, zero), expected.get(key, zero))
+        for key in sorted(expected.keys() | stored.keys())
+        if stored.get(key, zero) != expected.get(key, zero)
+    ]
+
+
+def ensure_backfilled():
+    # First start after upgrading: the rollup table is empty while tasks are not
+    if db.session.query(BudgetRollup.user_id).first() is None and db.session.query(Task.id).first() is not None:
+        rebuild()
@@ -0,0 +1,135 @@
+import re
+from flask import current_app
+from sqlalchemy import text, or_
+from models import Task
+
+# Searchable columns; Postgres tsvector weight label for each one
+SEARCH_FIELDS = {'task': 'A', 'owner': 'B', 'site_name': 'C'}
+
+# Set by init_search(): 'fts5', 'tsvector' or None (plain ILIKE)
+_backend = None
+
+
+def init_search(engine):
+    """Create the full-text index for the engine's dialect and keep it in sync with the task table.
+
+    Sync happens inside the database (triggers on SQLite, a generated column
+    on Postgres), so every write path - /add, /update, /delete, the chatbot
+    and bulk statements - updates the index in the same transaction.
+    """
+    global _backend
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == 'sqlite':
+                _init_fts5(conn)
+                _backend = 'fts5'
+            elif engine.dialect.name == 'postgresql':
+                _init_tsvector(conn)
+                _backend = 'tsvector'
+    except Exception:
+        # FTS5 not compiled in / insufficient privileges: fall back to ILIKE
+        current_app.logger.warning('Full-text search unavailable, using ILIKE', exc_info=True)
+        _backend = None
+
+
+def _init_fts5(conn):
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_fts'")).first()
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5("
+        "task, owner, site_name, content='task', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_fts_ai AFTER INSERT ON task BEGIN "
+        "INSERT INTO task_fts(rowid, task, owner, site_name) VALUES (new.id, new.task, new.owner, new.site_name); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_fts_ad AFTER DELETE ON task BEGIN "
+        "INSERT INTO task_fts(task_fts, rowid, task, owner, site_name) VALUES ('delete', old.id, old.task, old.owner, old.site_name); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS task_fts_au AFTER UPDATE OF task, owner, site_name ON task BEGIN "
+        "INSERT INTO task_fts(task_fts, rowid, task, owner, site_name) VALUES ('delete', old.id, old.task, old.owner, old.site_name); "
+        "INSERT INTO task_fts(rowid, task, owner, site_name) VALUES (new.id, new.task, new.owner, new.site_name); "
+        "END"
+    ))
+    if not exists:
+        # Index rows written before the search table existed
+        conn.execute(text("INSERT INTO task_fts(task_fts) VALUES ('rebuild')"))
+
+
+def _init_tsvector(conn):
+    vector = ' || '.join(
+        f"setweight(to_tsvector('simple', coalesce({field}, '')), '{weight}')"
+        for field, weight in SEARCH_FIELDS.items()
+    )
+    conn.execute(text(f"ALTER TABLE task ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_search_vector ON task USING gin (search_vector)"))
+    # Trigram indexes serve the substring fallback; the extension may need superuser rights
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for field in SEARCH_FIELDS:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_task_{field}_trgm ON task USING gin ({field} gin_trgm_ops)"))
+    except Exception:
+        current_app.logger.warning('pg_trgm unavailable, substring search fallback is unindexed')
+
+
+def result_limit(requested=None):
+    default = current_app.config.get('SEARCH_RESULT_LIMIT', 50)
+    maximum = current_app.config.get('SEARCH_RESULT_LIMIT_MAX', 200)
+    return max(1, min(requested or default, maximum))
+
+
+def search_tasks(user_id, q, field='task', limit=50):
+    """Return up to ``limit`` of the user's tasks matching ``q``, best match first.
+
+    Every word in ``q`` is matched as a prefix; when nothing matches that
+    way, ``q`` is matched as a substring instead. ``field`` is one of
+    SEARCH_FIELDS, or 'all' to match words against any of them.
+    """
+    terms = re.findall(r'\w+', q.lower())
+    fields = list(SEARCH_FIELDS) if field == 'all' else [field if field in SEARCH_FIELDS else 'task']
+    tasks = []
+    if terms and _backend == 'fts5':
+        tasks = _search_fts5(user_id, terms, fields, limit)
+    elif terms and _backend == 'tsvector':
+        tasks = _search_tsvector(user_id, terms, fields, limit)
+    if not tasks and q:
+        # Nothing starts with the words (or there are none, or no full-text index): substring match, so 'ite'
+        # or '-' finds the same tasks on every backend; trigram-indexed on Postgres, scoped by user_id on SQLite
+        tasks = _search_ilike(user_id, q, fields, limit)
+    return tasks
+
+
+def _task_columns():
+    return ', '.join(f'task.{column.name}' for column in Task.__table__.columns)
+
+
+def _search_fts5(user_id, terms, fields, limit):
+    match = '{%s} : (%s)' % (' '.join(fields), ' '.join(f'"{term}"*' for term in terms))
+    stmt = text(
+        f"SELECT {_task_columns()} FROM task_fts JOIN task ON task.id = task_fts.rowid "
+        "WHERE task_fts MATCH :match AND task.user_id = :user_id "
+        "ORDER BY task_fts.rank LIMIT :limit"
+    )
+    return Task.query.from_statement(stmt.bindparams(match=match, user_id=user_id, limit=limit)).all()
+
+
+def _search_tsvector(user_id, terms, fields, limit):
+    weights = '' if len(fields) == len(SEARCH_FIELDS) else ''.join(SEARCH_FIELDS[f] for f in fields)
+    query = ' & '.join(f'{term}:*{weights}' for term in terms)
+    stmt = text(
+        f"SELECT {_task_columns()} FROM task, to_tsquery('simple', :query) AS query "
+        "WHERE task.user_id = :user_id AND task.search_vector @@ query "
+        "ORDER BY ts_rank(task.search_vector, query) DESC, task.id LIMIT :limit"
+    )
+    return Task.query.from_statement(stmt.bindparams(query=query, user_id=user_id, limit=limit)).all()
+
+
+def _search_ilike(user_id, q, fields, limit):
+    pattern = f'%{q}%'
+    return (Task.query.filter(Task.user_id == user_id, or_(*(getattr(Task, f).ilike(pattern) for f in fields)))
+            .order_by(Task.id).limit(limit).all())
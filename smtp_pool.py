@@ -0,0 +1,188 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from flask_mail import BadHeaderError, sanitize_address, sanitize_addresses
+from metrics import Histogram
+
+# Upper bounds (seconds) of the delivery latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def is_connection_error(exc):
+    """True when ``exc`` means the SMTP session (or server) is unusable, not just this one message."""
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError)):
+        return True
+    # Every SMTPException is an OSError; only bare socket errors count here
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions open and reuses them across messages.
+
+    STARTTLS and AUTH are paid once per connection instead of once per
+    message. A connection idle longer than ``check_after`` is probed with
+    NOOP before reuse, one idle past ``max_idle`` or used for
+    ``max_messages`` sends is closed, and any connection-level error
+    discards the session so the next send reconnects.
+    """
+
+    def __init__(self, host, port, use_tls=False, use_ssl=False, username=None, password=None,
+                 max_size=4, max_idle=60, check_after=5, max_messages=100, timeout=30):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = []  # (smtp, last_used, messages_sent)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._stats = {
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'connections_stale': 0,
+            'messages_sent': 0,
+            'messages_failed': 0,
+            'connect_seconds_total': 0.0,
+            'send_seconds_total': 0.0,
+            'send_seconds_max': 0.0,
+        }
+        self._send_seconds = Histogram(LATENCY_BUCKETS)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('MAIL_SERVER', 'localhost'),
+            config.get('MAIL_PORT', 25),
+            use_tls=config.get('MAIL_USE_TLS', False),
+            use_ssl=config.get('MAIL_USE_SSL', False),
+            username=config.get('MAIL_USERNAME'),
+            password=config.get('MAIL_PASSWORD'),
+            max_size=config.get('MAIL_POOL_SIZE', 4),
+            max_idle=config.get('MAIL_POOL_MAX_IDLE', 60),
+            max_messages=config.get('MAIL_POOL_MAX_MESSAGES', 100),
+        )
+
+    def _open(self):
+        started = time.perf_counter()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self._stats['connections_opened'] += 1
+            self._stats['connect_seconds_total'] += time.perf_counter() - started
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _is_alive(self, smtp):
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, last_used, sent = self._idle.pop()
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle or (idle_for > self.check_after and not self._is_alive(smtp)):
+                with self._lock:
+                    self._stats['connections_stale'] += 1
+                self._close(smtp)
+                continue
+            with self._lock:
+                self._stats['connections_reused'] += 1
+            return smtp, sent
+        return self._open(), 0
+
+    @contextmanager
+    def connection(self):
+        """Check out a live SMTP session; it goes back to the pool unless a connection error escaped."""
+        with self._slots:
+            smtp, sent = self._checkout()
+            try:
+                yield smtp
+            except Exception as exc:
+                if is_connection_error(exc):
+                    self._close(smtp)
+                else:
+                    # Per-message failure (refused recipient, bad data): the session is still usable
+                    self._release(smtp, sent)
+                raise
+            self._release(smtp, sent + 1)
+
+    def _release(self, smtp, sent):
+        if sent >= self.max_messages:
+            self._close(smtp)
+            return
+        with self._lock:
+            self._idle.append((smtp, time.monotonic(), sent))
+
+    def sendmail(self, sender, recipients, data):
+        started = time.perf_counter()
+        try:
+            try:
+                with self.connection() as smtp:
+                    smtp.sendmail(sender, recipients, data)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped a pooled session between NOOP checks; retry once on a fresh one
+                with self.connection() as smtp:
+                    smtp.sendmail(sender, recipients, data)
+        except Exception:
+            with self._lock:
+                self._stats['messages_failed'] += 1
+            raise
+        self._observe(time.perf_counter() - started)
+
+    def send_message(self, message):
+        """Send a Flask-Mail ``Message`` with the same checks ``Connection.send`` applies."""
+        assert message.send_to, 'No recipients have been added'
+        assert message.sender, 'The message does not specify a sender and a default sender has not been configured'
+        if message.has_bad_headers():
+            raise BadHeaderError
+        if message.date is None:
+            message.date = time.time()
+        self.sendmail(sanitize_address(message.sender), list(sanitize_addresses(message.send_to)), message.as_bytes())
+
+    def _observe(self, seconds):
+        with self._lock:
+            self._stats['messages_sent'] += 1
+            self._stats['send_seconds_total'] += seconds
+            self._stats['send_seconds_max'] = max(self._stats['send_seconds_max'], seconds)
+            self._send_seconds.observe(seconds)
+
+    def stats(self):
+        """Counters plus a cumulative delivery latency histogram ({upper bound: count})."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle_connections'] = len(self._idle)
+            stats['send_seconds_histogram'] = dict(self._send_seconds.cumulative())
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _, _ in idle:
+            self._close(smtp)
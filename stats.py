@@ -0,0 +1,14 @@
+from sqlalchemy import func
+from models import db, Task
+
+
+def task_status_summary(user_id):
+    # One grouped query instead of a COUNT per status; keys match the template variables
+    rows = db.session.query(Task.status, func.count(Task.id)).filter(Task.user_id == user_id).group_by(Task.status).all()
+    counts = {status: count for status, count in rows}
+    return {
+        'total_tasks': sum(counts.values()),
+        'active_count': counts.get('Active', 0),
+        'onhold_count': counts.get('On hold', 0),
+        'closed_count': counts.get('Closed', 0),
+    }
@@ -0,0 +1,33 @@
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+from models import Task, User
+
+# session.info key holding the ids of users whose tasks changed in the current transaction
+_CHANGED_USERS = 'changed_user_ids'
+
+
+def mark_user_changed(session, user_id):
+    """Record that ``user_id``'s tasks changed; needed for Core bulk statements, ORM writes are picked up automatically."""
+    session.info.setdefault(_CHANGED_USERS, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Task) and obj.user_id is not None:
+            mark_user_changed(session, obj.user_id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_data_versions(session):
+    # before_commit fires ahead of commit's own flush; flush now so every change is collected
+    session.flush()
+    user_ids = session.info.get(_CHANGED_USERS)
+    if user_ids:
+        session.execute(update(User).where(User.id.in_(user_ids)).values(data_version=User.data_version + 1))
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop(_CHANGED_USERS, None)
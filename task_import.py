@@ -0,0 +1,134 @@
+import csv
+import json
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, Task, TASK_STATUSES, canonical_status
+import rollup
+
+IMPORT_FIELDS = ('task', 'owner', 'contact', 'summary', 'phone', 'site_name', 'status', 'project_cost', 'execution_cost')
+REQUIRED_FIELDS = ('task', 'owner', 'contact')
+
+
+def parse_cost(value):
+    # Same rule as /add: anything int() accepts, otherwise 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _normalise_key(key):
+    # Accept both 'site_name' and the progress export's 'Site Name' headers
+    return (key or '').strip().lower().replace(' ', '_')
+
+
+def _decode_lines(stream, bad_lines):
+    # Decode line by line, so a line that is not UTF-8 becomes a row error instead of ending the upload;
+    # it is replaced by a blank line, which both readers skip, and its number noted in bad_lines
+    for line_number, raw in enumerate(stream, start=1):
+        try:
+            yield raw.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            bad_lines.append(line_number)
+            yield '\n'
+
+
+def _undecodable(bad_lines):
+    while bad_lines:
+        yield bad_lines.pop(0), 'Not valid UTF-8 text'
+
+
+def iter_records(stream, content_type):
+    """Yield (line_number, dict or error message) from a CSV or JSON lines upload, one row at a time."""
+    bad_lines = []
+    lines = _decode_lines(stream, bad_lines)
+    if 'csv' in content_type:
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # The reader resumes at the next line, so the rest of the file is still imported
+                yield from _undecodable(bad_lines)
+                # DictReader.line_num only advances on success; the underlying reader's counts the bad row
+                yield reader.reader.line_num, f'Malformed CSV: {e}'
+                continue
+            yield from _undecodable(bad_lines)
+            yield reader.line_num, {_normalise_key(k): v for k, v in row.items() if k is not None}
+        yield from _undecodable(bad_lines)
+        return
+    for line_number, line in enumerate(lines, start=1):
+        yield from _undecodable(bad_lines)
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, 'Invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, 'Expected a JSON object'
+            continue
+        yield line_number, {_normalise_key(k): v for k, v in record.items()}
+
+
+def validate_record(record):
+    """Return (row values, None) for a valid record or (None, error message)."""
+    missing = [name for name in REQUIRED_FIELDS if not str(record.get(name) or '').strip()]
+    if missing:
+        return None, 'Missing required fields: ' + ', '.join(missing)
+    values = {}
+    for name in IMPORT_FIELDS:
+        value = record.get(name)
+        if name in ('project_cost', 'execution_cost'):
+            values[name] = parse_cost(value)
+            continue
+        value = '' if value is None else str(value).strip()
+        limit = Task.__table__.c[name].type.length
+        if limit and len(value) > limit:
+            return None, f'{name} is longer than {limit} characters'
+        values[name] = value
+    status = canonical_status(values['status'] or 'Active')
+    if status is None:
+        return None, 'status must be one of ' + ', '.join(TASK_STATUSES)
+    values['status'] = status
+    return values, None
+
+
+def import_records(records, user_id, batch_size=1000, max_errors=1000):
+    """Validate ``records`` and insert the valid ones in executemany batches within the current transaction.
+
+    Returns the report dict; the caller commits.
+    """
+    imported = failed = 0
+    errors = []
+    batch = []
+
+    def flush():
+        created_at = datetime.utcnow()
+        for values in batch:
+            values['created_at'] = created_at
+        db.session.execute(insert(Task), batch)
+        # Core inserts skip the session flush hooks, so update the budget rollup here
+        rollup.apply_deltas(db.session.connection(), [
+            rollup.contribution(user_id, created_at, v['project_cost'], v['execution_cost']) for v in batch
+        ])
+        batch.clear()
+
+    for line_number, record in records:
+        values, error = (None, record) if isinstance(record, str) else validate_record(record)
+        if error:
+            failed += 1
+            if len(errors) < max_errors:
+                errors.append({'row': line_number, 'message': error})
+            continue
+        values['user_id'] = user_id
+        batch.append(values)
+        imported += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return {'imported': imported, 'failed': failed, 'errors': errors}
@@ -1,28 +1,96 @@
-from flask import Blueprint, request, jsonify, render_template, Response, url_for, abort
+from flask import Blueprint, request, jsonify, render_template, stream_template, url_for, abort, current_app
 from flask_login import login_required, current_user
-from models import db, Task, User
+from sqlalchemy import and_, update, delete
+from models import db, Task, User, TASK_STATUSES, canonical_status
+from stats import task_status_summary
+from pagination import keyset_page, page_size, InvalidCursor, KeysetPageStream
+import search
+from exports import csv_response, export_response, available_formats, progress_csv
+from reports import iter_report_batches, iter_report_rows, report_filters, report_totals, report_rollup, InvalidFilter, REPORT_GROUPS
+from task_import import parse_cost, iter_records, import_records
+import rollup
+from cache import visitor_cache
+from task_changes import mark_user_changed
+from conditional import app_version, conditional, user_data_etag
+from replica import read_replica
 
 tasks_bp = Blueprint('tasks', __name__)
 
 
+def _task_json(t):
+    return {
+        'id': t.id,
+        'task': t.task,
+        'owner': t.owner,
+        'contact': t.contact,
+        'summary': t.summary,
+        'phone': t.phone,
+        'site_name': t.site_name,
+        'created_at': t.created_at.isoformat() if t.created_at else '',
+        'status': t.status,
+        'project_cost': getattr(t, 'project_cost', 0),
+        'execution_cost': getattr(t, 'execution_cost', 0)
+    }
+
+def _dashboard_page(user_id):
+    try:
+        return KeysetPageStream(Task.query.filter_by(user_id=user_id), request.args.get('cursor'), page_size())
+    except InvalidCursor:
+        abort(400)
+
+def _user_data_validators():
+    return user_data_etag(current_user.id), None
+
+def _report_filters():
+    # ?status= (repeatable), ?from= and ?to= narrow the progress report and its downloads
+    try:
+        return report_filters(request.args)
+    except InvalidFilter as e:
+        abort(400, description=str(e))
+
+def _progress_report(user_id, **context):
+    # ?totals=1 adds a totals row, ?group=site|status a per-site or per-status rollup
+    group = request.args.get('group')
+    filters = _report_filters()
+    # Streamed straight off the report cursor, so memory stays flat however many tasks there are
+    return stream_template(
+        'progress_report.html',
+        rows=iter_report_rows(user_id, **filters),
+        totals=report_totals(user_id, **filters) if request.args.get('totals') else None,
+        rollup=report_rollup(user_id, group, **filters) if group in REPORT_GROUPS else None,
+        group=group,
+        statuses=TASK_STATUSES,
+        export_formats=available_formats(),
+        **context
+    )
+
+def _task_validators(task_id):
+    row = db.session.query(Task.version, Task.updated_at).filter_by(id=task_id, user_id=current_user.id).first()
+    if row is None:
+        abort(404)
+    return f'task-{task_id}-{row.version}-{app_version()}', row.updated_at
+
+
 @tasks_bp.route('/user')
 @login_required
 def user_page():
-    total_tasks = Task.query.filter_by(user_id=current_user.id).count()
-    active_count = Task.query.filter_by(user_id=current_user.id, status='Active').count()
-    onhold_count = Task.query.filter_by(user_id=current_user.id, status='On hold').count()
-    closed_count = Task.query.filter_by(user_id=current_user.id, status='Closed').count()
-    return render_template('user.html', total_tasks=total_tasks, active_count=active_count, onhold_count=onhold_count, closed_count=closed_count)
+    return render_template('user.html', **task_status_summary(current_user.id))
 
 @tasks_bp.route('/dashboard')
 @login_required
+@conditional(_user_data_validators)
 def dashboard():
-    tasks = Task.query.filter_by(user_id=current_user.id).all()
-    total_tasks = len(tasks)
-    active_count = sum(1 for t in tasks if t.status == 'Active')
-    onhold_count = sum(1 for t in tasks if t.status == 'On hold')
-    closed_count = sum(1 for t in tasks if t.status == 'Closed')
-    return render_template('dashboard.html', tasks=tasks, total_tasks=total_tasks, active_count=active_count, onhold_count=onhold_count, closed_count=closed_count)
+    # Streamed: cards go out as rows arrive from the cursor
+    return stream_template('dashboard.html', tasks=_dashboard_page(current_user.id), **task_status_summary(current_user.id))
+
+@tasks_bp.route('/tasks')
+@login_required
+def list_tasks():
+    try:
+        tasks, next_cursor = keyset_page(Task.query.filter_by(user_id=current_user.id), request.args.get('cursor'), page_size())
+    except InvalidCursor:
+        return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+    return jsonify({'tasks': [_task_json(t) for t in tasks], 'next_cursor': next_cursor})
 
 @tasks_bp.route('/add', methods=['POST'])
 @login_required
@@ -44,18 +112,31 @@ def add_task():
     new_task.site_name = data.get('site_name', '')
     new_task.status = data.get('status', 'Active')
     # Costs: ensure integers; default 0
-    try:
-        new_task.project_cost = int(data.get('project_cost', 0))
-    except (TypeError, ValueError):
-        new_task.project_cost = 0
-    try:
-        new_task.execution_cost = int(data.get('execution_cost', 0))
-    except (TypeError, ValueError):
-        new_task.execution_cost = 0
+    new_task.project_cost = parse_cost(data.get('project_cost', 0))
+    new_task.execution_cost = parse_cost(data.get('execution_cost', 0))
     new_task.user_id = current_user.id
     db.session.add(new_task)
     db.session.commit()
-    return jsonify({'id': new_task.id, 'task': new_task.task, 'owner': new_task.owner, 'contact': new_task.contact, 'summary': new_task.summary, 'phone': new_task.phone, 'site_name': new_task.site_name, 'created_at': new_task.created_at.isoformat(), 'status': new_task.status, 'project_cost': new_task.project_cost, 'execution_cost': new_task.execution_cost})
+    return jsonify(_task_json(new_task))
+
+@tasks_bp.route('/import', methods=['POST'])
+@login_required
+def import_tasks():
+    # CSV (text/csv) or JSON lines (application/x-ndjson), read and inserted as it streams in
+    content_type = request.mimetype or ''
+    if 'csv' not in content_type and 'json' not in content_type:
+        return jsonify({'status': 'error', 'message': 'Send text/csv or application/x-ndjson'}), 415
+    records = iter_records(request.stream, content_type)
+    try:
+        report = import_records(records, current_user.id,
+                                batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 1000),
+                                max_errors=current_app.config.get('IMPORT_MAX_ERRORS', 1000))
+        mark_user_changed(db.session, current_user.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify({'status': 'success', **report})
 
 @tasks_bp.route('/update', methods=['POST'])
 @login_required
@@ -97,103 +178,128 @@ def delete_task(task_id):
         return jsonify({'status': 'deleted'})
     return jsonify({'status': 'error'}), 404
 
+def _batch_request():
+    # Returns (ids, data) or (None, error response)
+    data = request.json if request.is_json else None
+    if not data:
+        return None, (jsonify({'status': 'error', 'message': 'No data provided'}), 400)
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None, (jsonify({'status': 'error', 'message': 'ids must be a non-empty list of task ids'}), 400)
+    if len(ids) > current_app.config.get('BATCH_MAX_IDS', 1000):
+        return None, (jsonify({'status': 'error', 'message': 'Too many ids'}), 400)
+    return ids, data
+
+def _batch_scope(ids):
+    # Set-based statements bypass the flush hooks, so record the change here
+    mark_user_changed(db.session, current_user.id)
+    return and_(Task.id.in_(ids), Task.user_id == current_user.id)
+
+@tasks_bp.route('/batch/status', methods=['POST'])
+@login_required
+def batch_update_status():
+    ids, data = _batch_request()
+    if ids is None:
+        return data
+    status = canonical_status(data.get('status'))
+    if status is None:
+        return jsonify({'status': 'error', 'message': 'status must be one of ' + ', '.join(TASK_STATUSES)}), 400
+    result = db.session.execute(update(Task).where(_batch_scope(ids)).values(status=status))
+    db.session.commit()
+    return jsonify({'status': 'success', 'updated': result.rowcount})
+
+@tasks_bp.route('/batch/costs', methods=['POST'])
+@login_required
+def batch_update_costs():
+    ids, data = _batch_request()
+    if ids is None:
+        return data
+    values = {}
+    for field in ('project_cost', 'execution_cost'):
+        if field in data:
+            try:
+                values[field] = max(int(data[field]), 0)
+            except (TypeError, ValueError):
+                return jsonify({'status': 'error', 'message': f'{field} must be an integer'}), 400
+    if not values:
+        return jsonify({'status': 'error', 'message': 'Provide project_cost and/or execution_cost'}), 400
+    scope = _batch_scope(ids)
+    connection = db.session.connection()
+    before = rollup.stored_contributions(connection, scope)
+    result = db.session.execute(update(Task).where(scope).values(**values))
+    # Set-based statements bypass the flush hooks, so move the rollup totals here
+    rollup.apply_deltas(connection, before + rollup.stored_contributions(connection, scope, sign=1))
+    db.session.commit()
+    return jsonify({'status': 'success', 'updated': result.rowcount})
+
+@tasks_bp.route('/batch/delete', methods=['POST'])
+@login_required
+def batch_delete():
+    ids, data = _batch_request()
+    if ids is None:
+        return data
+    scope = _batch_scope(ids)
+    connection = db.session.connection()
+    rollup.apply_deltas(connection, rollup.stored_contributions(connection, scope))
+    result = db.session.execute(delete(Task).where(scope))
+    db.session.commit()
+    return jsonify({'status': 'deleted', 'deleted': result.rowcount})
+
 @tasks_bp.route('/task/<int:task_id>')
 @login_required
+@conditional(_task_validators)
 def view_task(task_id):
     task = Task.query.filter_by(id=task_id, user_id=current_user.id).first_or_404()
     return render_template('task_view.html', task=task)
 
 @tasks_bp.route('/search')
 @login_required
+@conditional(_user_data_validators)
 def search_tasks():
     q = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'task')
     if not q:
         return jsonify([])
-    if search_type == 'owner':
-        tasks = Task.query.filter(Task.owner.ilike(f'%{q}%'), Task.user_id == current_user.id).all()
-    elif search_type == 'site_name':
-        tasks = Task.query.filter(Task.site_name.ilike(f'%{q}%'), Task.user_id == current_user.id).all()
-    else:
-        tasks = Task.query.filter(Task.task.ilike(f'%{q}%'), Task.user_id == current_user.id).all()
-    return jsonify([
-        {
-            'id': t.id,
-            'task': t.task,
-            'owner': t.owner,
-            'contact': t.contact,
-            'summary': t.summary,
-            'phone': t.phone,
-            'site_name': t.site_name,
-            'created_at': t.created_at.isoformat() if t.created_at else '',
-            'status': t.status,
-            'project_cost': getattr(t, 'project_cost', 0),
-            'execution_cost': getattr(t, 'execution_cost', 0)
-        } for t in tasks
-    ])
+    tasks = search.search_tasks(current_user.id, q, search_type, search.result_limit(request.args.get('limit', type=int)))
+    return jsonify([_task_json(t) for t in tasks])
 
 @tasks_bp.route('/progress')
 @login_required
+@read_replica
+@conditional(_user_data_validators)
 def progress_report():
-    tasks = Task.query.filter_by(user_id=current_user.id).all()
-    # Fields needed for the report: Site Name, Task, Owner, Status, Summary, Project Cost, Execution Cost, % Profit
-    report_rows = [
-        {
-            'site_name': t.site_name or '',
-            'task': t.task or '',
-            'owner': t.owner or '',
-            'status': t.status or '',
-            'summary': t.summary or '',
-            'project_cost': getattr(t, 'project_cost', 0) or 0,
-            'execution_cost': getattr(t, 'execution_cost', 0) or 0,
-            'profit_percent': (
-                (round(((getattr(t, 'project_cost', 0) or 0) - (getattr(t, 'execution_cost', 0) or 0)) * 100.0 / (getattr(t, 'project_cost', 0) or 1), 2))
-                if (getattr(t, 'project_cost', 0) or 0) > 0 else 0.0
-            )
-        }
-        for t in tasks
-    ]
-    return render_template('progress_report.html', rows=report_rows)
+    return _progress_report(current_user.id)
 
 @tasks_bp.route('/progress.csv')
 @login_required
+@read_replica
 def download_progress_csv():
-    tasks = Task.query.filter_by(user_id=current_user.id).all()
-    # Build CSV content in-memory
-    def generate_csv():
-        yield 'Site Name,Task,Owner,Status,Summary,Project Cost,Execution Cost,% Profit\r\n'
-        for t in tasks:
-            # Basic CSV escaping for commas, quotes, and newlines
-            def esc(value):
-                if value is None:
-                    value = ''
-                value = str(value)
-                if '"' in value or ',' in value or '\n' in value or '\r' in value:
-                    value = '"' + value.replace('"', '""') + '"'
-                return value
-            project_cost = getattr(t, 'project_cost', 0) or 0
-            execution_cost = getattr(t, 'execution_cost', 0) or 0
-            profit_percent = round(((project_cost - execution_cost) * 100.0 / project_cost), 2) if project_cost > 0 else 0.0
-            yield f"{esc(t.site_name)},{esc(t.task)},{esc(t.owner)},{esc(t.status)},{esc(t.summary)},{esc(project_cost)},{esc(execution_cost)},{esc(str(profit_percent) + '%')}\r\n"
-
-    headers = {
-        'Content-Disposition': 'attachment; filename="progress_report.csv"'
-    }
-    return Response(generate_csv(), mimetype='text/csv', headers=headers)
+    # Same options as /progress: ?group=site|status exports the rollup instead, ?totals=1 appends a totals row
+    filename, header, rows = progress_csv(current_user.id, request.args.get('group'),
+                                          totals=bool(request.args.get('totals')), **_report_filters())
+    return csv_response(filename, header, rows)
+
+@tasks_bp.route('/progress.<any(xlsx, parquet, arrow):fmt>')
+@login_required
+@read_replica
+def download_progress_export(fmt):
+    # Typed, columnar downloads of the report rows; takes the same filters as /progress.csv
+    if fmt not in available_formats():
+        abort(404)
+    return export_response(f'progress_report.{fmt}', fmt, iter_report_batches(current_user.id, **_report_filters()))
 
 # Visitor dashboard (read-only)
 @tasks_bp.route('/view/<int:user_id>/dashboard')
+@read_replica
+@visitor_cache.cached
 def visitor_dashboard(user_id):
     user = User.query.get_or_404(user_id)
-    tasks = Task.query.filter_by(user_id=user.id).all()
-    total_tasks = len(tasks)
-    active_count = sum(1 for t in tasks if t.status == 'Active')
-    onhold_count = sum(1 for t in tasks if t.status == 'On hold')
-    closed_count = sum(1 for t in tasks if t.status == 'Closed')
-    return render_template('dashboard.html', tasks=tasks, total_tasks=total_tasks, active_count=active_count, onhold_count=onhold_count, closed_count=closed_count, visitor_mode=True, user=user)
+    return stream_template('dashboard.html', tasks=_dashboard_page(user.id), visitor_mode=True, user=user, **task_status_summary(user.id))
 
 # Visitor task view (read-only)
 @tasks_bp.route('/view/<int:user_id>/task/<int:task_id>')
+@read_replica
+@visitor_cache.cached
 def visitor_task_view(user_id, task_id):
     user = User.query.get_or_404(user_id)
     task = Task.query.filter_by(id=task_id, user_id=user.id).first_or_404()
@@ -201,24 +307,9 @@ def visitor_task_view(user_id, task_id):
 
 # Visitor progress report (read-only)
 @tasks_bp.route('/view/<int:user_id>/progress')
+@read_replica
+@visitor_cache.cached
 def visitor_progress_report(user_id):
     user = User.query.get_or_404(user_id)
-    tasks = Task.query.filter_by(user_id=user.id).all()
-    report_rows = [
-        {
-            'site_name': t.site_name or '',
-            'task': t.task or '',
-            'owner': t.owner or '',
-            'status': t.status or '',
-            'summary': t.summary or '',
-            'project_cost': getattr(t, 'project_cost', 0) or 0,
-            'execution_cost': getattr(t, 'execution_cost', 0) or 0,
-            'profit_percent': (
-                (round(((getattr(t, 'project_cost', 0) or 0) - (getattr(t, 'execution_cost', 0) or 0)) * 100.0 / (getattr(t, 'project_cost', 0) or 1), 2))
-                if (getattr(t, 'project_cost', 0) or 0) > 0 else 0.0
-            )
-        }
-        for t in tasks
-    ]
-    return render_template('progress_report.html', rows=report_rows, visitor_mode=True, user=user)
+    return _progress_report(user.id, visitor_mode=True, user=user)
 
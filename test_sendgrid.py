@@ -10,13 +10,14 @@ import requests
 import json
 import time
 from datetime import datetime
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from smtp_pool import SMTPConnectionPool
+
 class SendGridTester:
     def __init__(self, base_url="http://localhost:5000"):
         self.base_url = base_url
@@ -78,13 +79,18 @@ class SendGridTester:
                 self.log_test("SendGrid SMTP", "SKIP", "No API key available")
                 return False
                 
-            # Test SMTP connection
-            server = smtplib.SMTP('smtp.sendgrid.net', 587)
-            server.starttls()
-            server.login('apikey', api_key)
-            server.quit()
+            # Test SMTP connection through the app's pooled transport: the second
+            # checkout should reuse the authenticated session instead of reconnecting
+            pool = SMTPConnectionPool('smtp.sendgrid.net', 587, use_tls=True, username='apikey', password=api_key)
+            for _ in range(2):
+                with pool.connection() as server:
+                    server.noop()
+            stats = pool.stats()
+            pool.close()
             
-            self.log_test("SendGrid SMTP", "PASS", "SMTP connection successful")
+            self.log_test("SendGrid SMTP", "PASS",
+                          f"SMTP connection successful (handshake {stats['connect_seconds_total'] * 1000:.0f} ms, "
+                          f"{stats['connections_reused']} reuse)")
             return True
             
         except Exception as e:
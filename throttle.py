@@ -0,0 +1,37 @@
+from flask import jsonify, request
+from cache import LRUCache, create_cache
+
+
+class LoginThrottle:
+    """Fixed-window attempt limits per client IP and per account email.
+
+    Checked before any password hash is computed, so a credential-stuffing
+    burst is turned away for the cost of a counter increment.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache(maxsize=4096)
+        self.window = 60
+        self.per_ip = 20
+        self.per_email = 10
+
+    def init_app(self, app):
+        self.window = app.config.get('LOGIN_RATE_WINDOW', 60)
+        self.per_ip = app.config.get('LOGIN_RATE_PER_IP', 20)
+        self.per_email = app.config.get('LOGIN_RATE_PER_EMAIL', 10)
+        self.backend = create_cache(app.config.get('LOGIN_RATE_CACHE_URL'), maxsize=4096, ttl=self.window)
+
+    def hit(self, email=None):
+        """Count an attempt from this request; returns a 429 response if a limit is exceeded, else None."""
+        over = self.backend.hit(f'throttle:ip:{request.remote_addr}', self.window) > self.per_ip
+        if email:
+            over = self.backend.hit(f'throttle:email:{email}', self.window) > self.per_email or over
+        if not over:
+            return None
+        response = jsonify({'status': 'error', 'message': 'Too many attempts, please try again later'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(self.window)
+        return response
+
+
+login_throttle = LoginThrottle()
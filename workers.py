@@ -0,0 +1,57 @@
+import os
+import threading
+from models import db
+
+
+class BackgroundWorker:
+    """Daemon threads that keep calling ``work()`` inside an app context.
+
+    Subclasses set ``name``, ``workers`` and ``poll_interval`` (usually in
+    ``init_app``) and implement ``work()``, which returns how many items it
+    handled; when that is 0 the thread sleeps until ``poll_interval``
+    passes or ``wake()`` is called. Threads do not survive fork, so
+    ``start()`` (re)starts them once per process.
+    """
+
+    name = 'worker'
+
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self.poll_interval = 5
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def work(self):
+        raise NotImplementedError
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() or not self.workers:
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    processed = self.work()
+                except Exception:
+                    self.app.logger.exception('%s worker failed', self.name)
+                    processed = 0
+                finally:
+                    db.session.remove()
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()